@@ -0,0 +1,223 @@
+"""
+Cache backends for the opt-in caches of the models and the views. They all
+have the same small interface: `get`, `set`, `delete`, `delete_many` and
+`clear`, and count their hits and misses.
+
+`MemoryCache` lives in the process. `StoreCache` is shared between processes
+through a Redis like key value store, `LocalStore` is an in-process stand-in
+for such a store to be used in tests and development.
+"""
+
+import fnmatch
+import pickle
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class BaseCache():
+    """
+    The interface of the cache backends. Keys are strings.
+    """
+
+    def __init__(self, ttl=None):
+        """
+        :param int ttl: Default time to live of the entries, in seconds. None
+            means the entries don't expire.
+        """
+
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def get_stats(self):
+        """
+        Returns the hit and miss counters of the cache.
+
+        :return dict:
+        """
+
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else None,
+        }
+
+
+class MemoryCache(BaseCache):
+    """
+    In-process cache with LRU eviction and an optional TTL. It is thread safe
+    but not shared between processes.
+
+    The values are stored as they are, not copied.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        :param int maxsize: Maximum number of entries, the least recently used
+            ones are evicted first.
+        :param int ttl: Default time to live of the entries, in seconds
+        """
+
+        super().__init__(ttl=ttl)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None \
+                    and entry[1] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class StoreCache(BaseCache):
+    """
+    Cache on a key value store shared between processes, through a client
+    having the Redis interface (`get`, `set` with `ex`, `delete` and
+    `scan_iter`), eg. `redis.Redis` or `LocalStore`. The values are pickled,
+    so only use it with a trusted store.
+    """
+
+    def __init__(self, client, prefix='zephony:', ttl=None):
+        """
+        :param object client: The key value store client
+        :param str prefix: Prefix of all the keys of this cache in the store
+        :param int ttl: Default time to live of the entries, in seconds
+        """
+
+        super().__init__(ttl=ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        self.client.set(
+            self.prefix + key,
+            pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+            ex=int(ttl) if ttl is not None else None,
+        )
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def delete_many(self, keys):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class LocalStore():
+    """
+    In-process stand-in for a Redis client, implementing the part of its
+    interface `StoreCache` uses. Values are kept as bytes, like Redis does.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _get_entry(self, name):
+        entry = self._data.get(name)
+        if entry is not None and entry[1] is not None \
+                and entry[1] <= time.monotonic():
+            del self._data[name]
+            return None
+        return entry
+
+    def get(self, name):
+        with self._lock:
+            entry = self._get_entry(name)
+            return entry[0] if entry is not None else None
+
+    def set(self, name, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        expires_at = time.monotonic() + ex if ex is not None else None
+
+        with self._lock:
+            self._data[name] = (bytes(value), expires_at)
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            count = 0
+            for name in names:
+                if self._get_entry(name) is not None:
+                    del self._data[name]
+                    count += 1
+            return count
+
+    def scan_iter(self, match=None):
+        with self._lock:
+            names = [
+                name for name in list(self._data)
+                if self._get_entry(name) is not None
+            ]
+
+        for name in names:
+            if match is None or fnmatch.fnmatchcase(name, match):
+                yield name
@@ -0,0 +1,182 @@
+"""
+Response compression of `ApiFlask`. The encoding is negotiated from the
+`Accept-Encoding` header of the request among gzip, which is always
+available, and zstd and brotli, which are used when the `zstandard` and
+`brotli` packages are installed.
+
+The compressors have the same small interface: `compress` to compress a part
+of the body, `flush` to get everything compressed so far, which is used
+between the chunks of streamed responses, and `finish` to end the body.
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipCompressor():
+    def __init__(self, level=6):
+        # 16 + the maximum window size makes zlib write gzip headers
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + 15)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor():
+    def __init__(self, level=4):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdCompressor():
+    def __init__(self, level=3):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# Content-Encoding -> compressor class, config key of the level and default
+# level
+COMPRESSORS = {
+    'zstd': (ZstdCompressor, 'COMPRESS_ZSTD_LEVEL', 3),
+    'br': (BrotliCompressor, 'COMPRESS_BR_LEVEL', 4),
+    'gzip': (GzipCompressor, 'COMPRESS_LEVEL', 6),
+}
+
+
+def get_available_encodings(encodings=('zstd', 'br', 'gzip')):
+    """
+    Filters the encodings down to the ones whose package is installed.
+
+    :param tuple encodings: The encodings, in the order of preference
+
+    :return list:
+    """
+
+    available = []
+    for encoding in encodings:
+        if encoding not in COMPRESSORS:
+            raise ValueError('`{}`: Unsupported encoding'.format(encoding))
+        if encoding == 'br' and brotli is None:
+            continue
+        if encoding == 'zstd' and zstandard is None:
+            continue
+        available.append(encoding)
+
+    return available
+
+
+def negotiate_encoding(accept_encodings, encodings):
+    """
+    Chooses the encoding with the highest quality in the `Accept-Encoding`
+    header, the order of `encodings` breaking ties.
+
+    :param Accept accept_encodings: The parsed header, eg.
+        `request.accept_encodings`
+    :param list encodings: The available encodings, in the order of
+        preference
+
+    :return str: The encoding, None if none is accepted
+    """
+
+    best = None
+    best_quality = 0
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+
+    return best
+
+
+def get_compressor(encoding, config):
+    """
+    :param str encoding: The Content-Encoding
+    :param dict config: The app config, for the compression level
+
+    :return object: A new compressor
+    """
+
+    compressor_class, level_key, default_level = COMPRESSORS[encoding]
+    return compressor_class(config.get(level_key, default_level))
+
+
+def compress(data, encoding, config):
+    """
+    Compresses a whole body.
+
+    :return bytes:
+    """
+
+    compressor = get_compressor(encoding, config)
+    return compressor.compress(data) + compressor.finish()
+
+
+def iter_compressed(chunks, compressor, on_finish=None):
+    """
+    Compresses a streamed body, flushing the compressor after every chunk so
+    that the chunks are sent as soon as they are generated.
+
+    :param iterable chunks: The chunks of the body
+    :param object compressor: The compressor
+    :param function on_finish: Called with the number of bytes before and
+        after the compression once the body is sent
+
+    :return generator:
+    """
+
+    bytes_in = 0
+    bytes_out = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue
+
+            bytes_in += len(chunk)
+            compressed = compressor.compress(chunk) + compressor.flush()
+            bytes_out += len(compressed)
+            yield compressed
+
+        compressed = compressor.finish()
+        bytes_out += len(compressed)
+        yield compressed
+    finally:
+        # The wrapped iterable is closed by WSGI servers through this one
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+    if on_finish is not None:
+        on_finish(bytes_in, bytes_out)
@@ -1,7 +1,11 @@
 import logging
+import os
 
 from functools import wraps
-from flask import request, redirect
+from urllib.parse import urlencode
+from flask import Response, current_app, request, redirect
+
+from .cache import MemoryCache
 
 from .exceptions import (
     ObjectNotFound,
@@ -11,6 +15,7 @@ from .exceptions import (
     InvalidRequestSchema,
 )
 from .helpers import (
+    get_user_identity,
     validate_schema_with_errors,
 )
 
@@ -59,3 +64,101 @@ def validate_schema(schema):
         return decorated_function
     return decorator
 
+
+def cached_response(cache=None, ttl=300, per_user=False, models=(),
+        key_prefix=None):
+    """
+    This decorator caches the responses of a GET view, keyed by the path, the
+    query parameters (in any order) and optionally the user. Only the `200`
+    responses are cached, as their encoded body, status and mimetype.
+
+    The entries expire after `ttl`, and are all invalidated whenever a
+    transaction writing objects of one of the `models` is committed, through
+    a generation token kept in the cache itself, so that the invalidation is
+    shared by the processes using a shared cache.
+
+    Example:
+        @cached_response(ttl=60, per_user=True, models=(Item, Category))
+        def get_all():
+            ...
+
+    :param BaseCache cache: A backend from `zephony.cache`, eg. a
+        StoreCache. An in-process `MemoryCache(maxsize=1024)` by default.
+    :param int ttl: Time to live of the entries, in seconds
+    :param bool per_user: Key the entries by the user too, `request.user` or
+        the `Authorization` header, see `get_user_identity`. Requests without
+        either are not cached.
+    :param tuple models: The models whose writes invalidate the entries
+    :param str key_prefix: Prefix of the keys, the module and name of the
+        view by default
+    """
+
+    if cache is None:
+        cache = MemoryCache(maxsize=1024, ttl=ttl)
+
+    def decorator(f):
+        prefix = key_prefix or '{}.{}'.format(f.__module__, f.__qualname__)
+        generation_key = '{}:generation'.format(prefix)
+
+        def get_generation():
+            generation = cache.get(generation_key)
+            if generation is None:
+                generation = invalidate()
+            return generation
+
+        def invalidate(*args):
+            generation = os.urandom(8).hex()
+            cache.set(generation_key, generation)
+            return generation
+
+        for model in models:
+            model.add_write_listener(invalidate)
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+
+            # The generation is read before the view queries, so a write in
+            # between leaves the entry under the previous generation
+            key = _get_response_cache_key(prefix, get_generation(), per_user)
+            if key is None:
+                return f(*args, **kwargs)
+
+            entry = cache.get(key)
+            if entry is not None:
+                body, status, mimetype = entry
+                return Response(body, status=status, mimetype=mimetype)
+
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed \
+                    and not response.direct_passthrough:
+                cache.set(key, (
+                    response.get_data(),
+                    response.status_code,
+                    response.mimetype,
+                ), ttl=ttl)
+            return response
+
+        decorated_function.invalidate = invalidate
+        decorated_function.cache = cache
+        return decorated_function
+    return decorator
+
+
+def _get_response_cache_key(prefix, generation, per_user=False):
+    """
+    Builds the cache key of the current request for `cached_response`, None
+    if it is per user and the user cannot be identified.
+    """
+
+    query = urlencode(sorted(request.args.lists()), doseq=True)
+    key = '{}:{}:{}?{}'.format(prefix, generation, request.path, query)
+
+    if per_user:
+        user_identity = get_user_identity()
+        if user_identity is None:
+            return None
+        key += ':{}'.format(user_identity)
+
+    return key
@@ -5,8 +5,8 @@ development.
 """
 
 import time
+import array
 import base64
-import codecs
 import csv
 import json
 import logging
@@ -15,17 +15,23 @@ import math
 import random
 import re
 import string
+import functools
 import hashlib
+import itertools
+import threading
 import pytz
 import datetime
-from datetime import datetime, timedelta
+from collections.abc import Iterator
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from email.utils import format_datetime
+from uuid import UUID
 from dateutil import parser
 
 import requests
 from flask import (
     Flask, Response, request, current_app as app,
-    render_template
+    render_template, stream_with_context
 )
 # from twilio.base.exceptions import TwilioRestException
 # from twilio.rest import Client as TwilioClient
@@ -33,6 +39,13 @@ from voluptuous import MultipleInvalid
 from unicodedata import normalize
 from werkzeug.utils import secure_filename
 
+from zephony import compression
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -60,17 +73,320 @@ def get_rows_from_csv(f_path, header=False, delimiter=',',\
     delimiter - CSV delimiter can be `,`, `;`, etc.
     int_fields - List of columns that has to be converted to integer
         - Empty values are returned as None.
+
+    Use `iter_rows_from_csv` to process big files without loading all the
+    rows in memory.
+    """
+
+    return list(iter_rows_from_csv(
+        f_path,
+        header=header,
+        delimiter=delimiter,
+        int_fields=int_fields,
+        empty_check_col=empty_check_col,
+    ))
+
+
+def iter_rows_from_csv(f_path, header=False, delimiter=',', int_fields=[],\
+        empty_check_col=None, batch_size=None, buffer_size=1024 * 1024):
+    """
+    Generator version of `get_rows_from_csv`. The file is read through a
+    large buffer and the rows are yielded as they are parsed, so the memory
+    used doesn't depend on the size of the file.
+
+    f_path - Represents the relative path of the CSV file
+    header - Set to True if the first row is to be skipped.
+    delimiter - CSV delimiter can be `,`, `;`, etc.
+    int_fields - List of columns that has to be converted to integer
+        - Empty values are returned as None.
+    empty_check_col - Rows having this column empty are skipped.
+    batch_size - If given, lists of up to `batch_size` rows are yielded
+        instead of single rows.
+    buffer_size - Size of the read buffer, in bytes.
     """
 
-    with codecs.open(f_path, encoding='utf-8', errors='ignore') as f:
-        f.seek(0)
+    with open(f_path, encoding='utf-8', errors='ignore', newline='',\
+            buffering=buffer_size) as f:
         reader = csv.reader(f, delimiter=delimiter)
 
         # Skip the header if specified
         if header:
-            next(reader)
+            next(reader, None)
+
+        rows = _iter_stripped_rows(reader, empty_check_col, int_fields)
+        if batch_size:
+            yield from get_chunks(rows, batch_size)
+        else:
+            yield from rows
+
+
+def _iter_stripped_rows(reader, empty_check_col=None, int_fields=[]):
+    for row in reader:
+        # Skip row if the required check is empty
+        if empty_check_col is not None:
+            if row[empty_check_col] == '':
+                continue
+
+        for i, col in enumerate(row):
+            row[i] = col.strip()
+        for i in int_fields:
+            row[i] = int(row[i]) if row[i] else None
+        yield row
+
+
+class CsvColumns():
+    """
+    A batch of CSV rows stored column by column, as returned by
+    `iter_columns_from_csv`.
+
+    The integer columns are `array.array('q')` (or NumPy arrays), the boolean
+    columns `array.array('b')`, the dates `datetime` objects and the other
+    columns strings, with the repeated values sharing the same object.
+    """
+
+    def __init__(self, columns, size):
+        """
+        :param list columns: The columns, in the order of the CSV
+        :param int size: The number of rows in the batch
+        """
+
+        self.columns = columns
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def get_column(self, index):
+        return self.columns[index]
+
+    def get_row(self, index):
+        return tuple(column[index] for column in self.columns)
+
+    def iter_rows(self):
+        """
+        Yields the rows of the batch as tuples.
+        """
+
+        return zip(*self.columns)
+
+
+def iter_columns_from_csv(f_path, schema, header=False, delimiter=',',\
+        empty_check_col=None, batch_size=10000, use_numpy=False):
+    """
+    Typed and columnar version of `iter_rows_from_csv`. The file is read in
+    batches of rows, which are transposed and converted column by column
+    according to the schema, so the casts happen once per column and the
+    repeated values are parsed only once.
+
+    f_path - Represents the relative path of the CSV file
+    schema - Dictionary of column index to type, the type being one of:
+        - `'int'` (or `int`): Empty values are returned as None.
+        - `'date'`: `dd/mm/yyyy` or `yyyy-mm-dd` dates, returned as
+          `datetime` objects. Empty values are returned as None.
+        - `'bool'`: True if the value is `x`.
+        - `'power_of_2'`: The value `n` is returned as `2 ** (n - 1)`, like
+          the permission bits.
+        The other columns are returned as strings.
+        Values that cannot be converted are kept as strings.
+    header - Set to True if the first row is to be skipped.
+    delimiter - CSV delimiter can be `,`, `;`, etc.
+    empty_check_col - Rows having this column empty are skipped.
+    batch_size - Number of rows in each `CsvColumns` yielded.
+    use_numpy - Return the integer and boolean columns as NumPy arrays. NumPy
+        has to be installed.
+    """
+
+    if use_numpy:
+        import numpy
+    else:
+        numpy = None
+
+    # Parsed dates and strings are shared across batches
+    memos = {}
+    for batch in iter_rows_from_csv(
+        f_path,
+        header=header,
+        delimiter=delimiter,
+        empty_check_col=empty_check_col,
+        batch_size=batch_size,
+    ):
+        width = max(len(row) for row in batch)
+        for row in batch:
+            if len(row) < width:
+                row.extend([''] * (width - len(row)))
+
+        columns = []
+        for i, values in enumerate(zip(*batch)):
+            type_ = schema.get(i, 'str')
+            if type_ is int:
+                type_ = 'int'
+            if type_ not in _COLUMN_CONVERTERS:
+                raise ValueError('`{}`: Unsupported column type'.format(type_))
+
+            memo = memos.setdefault(i, {})
+            columns.append(_COLUMN_CONVERTERS[type_](values, memo, numpy))
+
+        # Forget the values of the columns having too many distinct ones
+        for memo in memos.values():
+            if len(memo) > _MAX_MEMO_SIZE:
+                memo.clear()
+
+        yield CsvColumns(columns, len(batch))
+
+
+def _convert_str_column(values, memo, numpy=None):
+    return [memo.setdefault(value, value) for value in values]
+
+
+def _convert_int_column(values, memo, numpy=None):
+    column = []
+    compact = True
+    for value in values:
+        if not value:
+            column.append(None)
+            compact = False
+            continue
+
+        try:
+            column.append(int(value))
+        except ValueError:
+            column.append(value)
+            compact = False
+
+    if not compact:
+        return column
+
+    if numpy is not None:
+        return numpy.array(column, dtype=numpy.int64)
+
+    try:
+        return array.array('q', column)
+    except OverflowError:
+        return column
+
+
+def _convert_date_column(values, memo, numpy=None):
+    column = []
+    for value in values:
+        if not value:
+            column.append(None)
+            continue
+
+        if value not in memo:
+            try:
+                date_str_format = '%d/%m/%Y' if '/' in value else '%Y-%m-%d'
+                memo[value] = datetime.strptime(value, date_str_format)
+            except ValueError:
+                memo[value] = value
+        column.append(memo[value])
+
+    return column
+
+
+def _convert_bool_column(values, memo, numpy=None):
+    column = [value == 'x' for value in values]
+    if numpy is not None:
+        return numpy.array(column, dtype=bool)
+
+    return array.array('b', column)
+
+
+def _convert_power_of_2_column(values, memo, numpy=None):
+    column = []
+    for value in values:
+        if value not in memo:
+            try:
+                memo[value] = 2 ** (int(value) - 1)
+            except ValueError:
+                memo[value] = value
+        column.append(memo[value])
+
+    return column
+
+
+_MAX_MEMO_SIZE = 65536
+
+_COLUMN_CONVERTERS = {
+    'str': _convert_str_column,
+    'int': _convert_int_column,
+    'date': _convert_date_column,
+    'bool': _convert_bool_column,
+    'power_of_2': _convert_power_of_2_column,
+}
+
+
+def get_csv_byte_ranges(f_path, chunks_count, start=0):
+    """
+    This function splits a CSV file into `chunks_count` byte ranges of about
+    the same size, each ending at the end of a line, so that the chunks can
+    be parsed independently (see `iter_rows_from_csv_range`). Quoted values
+    spanning multiple lines are not supported.
+
+    :param str f_path: The relative path of the CSV file
+    :param int chunks_count: The number of chunks wanted
+    :param int start: Byte offset to start from
+
+    :return list(tuple): (start, end) byte offsets, fewer than `chunks_count`
+        for small files
+    """
+
+    size = os.path.getsize(f_path)
+    offsets = [start]
+    with open(f_path, 'rb') as f:
+        for i in range(1, chunks_count):
+            position = start + (size - start) * i // chunks_count
+            if position <= offsets[-1]:
+                continue
+
+            # Move to the beginning of the next line, the line starting right
+            # at `position` is kept
+            f.seek(position - 1)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+
+    if size > offsets[-1]:
+        offsets.append(size)
+
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def iter_rows_from_csv_range(f_path, start=0, end=None, header=False,\
+        delimiter=',', empty_check_col=None):
+    """
+    This function reads the rows of a byte range of a CSV file, as given by
+    `get_csv_byte_ranges`, one by one. The rows are processed like
+    `get_rows_from_csv` does. Each row is yielded with the byte offset right
+    after it, where reading can be resumed.
+
+    f_path - Represents the relative path of the CSV file
+    start - Byte offset of the beginning of a line
+    end - Byte offset to stop at, None to read till the end
+    header - Set to True if the first row is to be skipped, applies only
+        when starting at the beginning of the file.
+    delimiter - CSV delimiter can be `,`, `;`, etc.
+    """
+
+    with open(f_path, 'rb') as f:
+        f.seek(start)
+        offset = [start]
+
+        def get_lines():
+            for line in f:
+                offset[0] += len(line)
+                yield line.decode('utf-8', errors='ignore')
+                if end is not None and offset[0] >= end:
+                    return
+
+        reader = csv.reader(get_lines(), delimiter=delimiter)
+
+        # Skip the header if specified
+        if header and start == 0:
+            next(reader, None)
 
-        rows = []
         for row in reader:
             # Skip row if the required check is empty
             if empty_check_col is not None:
@@ -79,44 +395,113 @@ def get_rows_from_csv(f_path, header=False, delimiter=',',\
 
             for i, col in enumerate(row):
                 row[i] = col.strip()
-            rows.append(row)
-
-        return rows
+            yield row, offset[0]
 
 
 def get_rows_from_workbook_sheet(sheet, header=False, int_fields=[],\
         empty_check_col=None):
     """
-    f_path - Represents the relative path of the CSV file
+    sheet - The openpyxl worksheet
+    header - Set to True if the first row is to be skipped.
+    int_fields - List of columns that has to be converted to integer
+        - Empty values are returned as None.
+    empty_check_col - Rows having this column empty are skipped.
+
+    Use `iter_rows_from_workbook` to stream big workbooks.
+    """
+
+    return [
+        list(row) for row in iter_rows_from_workbook_sheet(
+            sheet,
+            header=header,
+            int_fields=int_fields,
+            empty_check_col=empty_check_col,
+        )
+    ]
+
+
+def iter_rows_from_workbook(f, sheet_name=None, header=False, int_fields=[],\
+        empty_check_col=None, batch_size=None):
+    """
+    Streams the rows of a sheet of an XLSX workbook. The workbook is opened
+    in the read-only mode of openpyxl, in which the rows are parsed as they
+    are iterated instead of the whole sheet being loaded first.
+
+    f - Path of the workbook, or a file object. An uploaded file (werkzeug
+        `FileStorage`) can be passed directly without saving it to disk.
+    sheet_name - Name of the sheet, the active sheet by default.
+    header - Set to True if the first row is to be skipped.
+    int_fields - List of columns that has to be converted to integer
+        - Empty values are returned as None.
+    empty_check_col - Rows having this column empty are skipped.
+    batch_size - If given, lists of up to `batch_size` rows are yielded
+        instead of single rows.
+    """
+
+    from openpyxl import load_workbook
+
+    # Uploaded files
+    if hasattr(f, 'stream'):
+        f = f.stream
+
+    workbook = load_workbook(f, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.active
+        rows = iter_rows_from_workbook_sheet(
+            sheet,
+            header=header,
+            int_fields=int_fields,
+            empty_check_col=empty_check_col,
+        )
+        if batch_size:
+            yield from get_chunks(rows, batch_size)
+        else:
+            yield from rows
+    finally:
+        # Read-only workbooks keep the file open until closed
+        workbook.close()
+
+
+def iter_rows_from_workbook_sheet(sheet, header=False, int_fields=[],\
+        empty_check_col=None):
+    """
+    Generator version of `get_rows_from_workbook_sheet`, yielding the rows as
+    tuples of stripped strings. Empty cells are returned as empty strings
+    and the other values converted to strings.
+
+    sheet - The openpyxl worksheet, preferably of a read-only workbook
     header - Set to True if the first row is to be skipped.
-    delimiter - CSV delimiter can be `,`, `;`, etc.
     int_fields - List of columns that has to be converted to integer
         - Empty values are returned as None.
+    empty_check_col - Rows having this column empty are skipped.
     """
 
-    reader = sheet.iter_rows()
+    reader = sheet.iter_rows(values_only=True)
 
     # Skip the header if specified
     if header:
-        next(reader)
+        next(reader, None)
+
+    for values in reader:
+        row = [
+            '' if value is None
+            else value.strip() if isinstance(value, str)
+            else str(value).strip()
+            for value in values
+        ]
 
-    rows = []
-    for row in reader:
         # Skip row if the required check is empty
         if empty_check_col is not None:
-            if row[empty_check_col] == '':
+            if len(row) <= empty_check_col or row[empty_check_col] == '':
                 continue
 
-        new_row = []
-        for i, col in enumerate(row):
-            print(col.value, type(col.value))
-            try:
-                new_row.append( col.value.strip())
-            except:
-                new_row.append(str(col.value).strip())
-        rows.append(new_row)
+        for i in int_fields:
+            value = values[i]
+            if isinstance(value, str):
+                value = value.strip()
+            row[i] = int(value) if value not in (None, '') else None
 
-    return rows
+        yield tuple(row)
 
 
 def responsify(data, message=None, http_status=200, pagination=None,\
@@ -130,10 +515,12 @@ def responsify(data, message=None, http_status=200, pagination=None,\
     data (success)  array/dictionary/None - contains the data
     errors:         array -
 
-    :param dict/list data: Data dict or list of errors
+    :param dict/list data: Data dict or list of errors, or a generator of
+        items to stream the response with `ApiFlask`
     :param str/None message: The optional message to be sent by the API
     :param int http_status: The status code of the response
     :param tuple pagination: current_page, standard_page_size, total_pages
+        and optionally next_cursor, when paginating by cursor
     :param summary:
 
     :return dict: The dictionary response that has to be jsonified
@@ -160,6 +547,8 @@ def responsify(data, message=None, http_status=200, pagination=None,\
             'standard_page_size': pagination[1],
             'total_pages': pagination[2],
         }
+        if len(pagination) > 3:
+            res['pagination']['next_cursor'] = pagination[3]
 
     if summary:
         res['summary'] = {
@@ -550,6 +939,87 @@ def generate_checksum_of_file(fpath):
     return hash_md5.hexdigest()
 
 
+def get_chunks(iterable, size):
+    """
+    This function splits any iterable into lists of `size` items, the last
+    one being shorter if the items run out. The iterable is consumed lazily.
+
+    :param iterable iterable:
+    :param int size: Number of items per chunk
+
+    :return generator(list):
+    """
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_cursor(values):
+    """
+    This function encodes the values of the last row of a page (the sort
+    column and the id) into an opaque, URL safe cursor token. Datetimes,
+    dates and decimals are tagged so that `decode_cursor` gives them back
+    with the same type.
+
+    :param list values: JSON serializable values, datetimes, dates, decimals
+
+    :return str: The cursor token
+    """
+
+    items = []
+    for value in values:
+        if isinstance(value, datetime):
+            items.append({'datetime': value.isoformat()})
+        elif isinstance(value, date):
+            items.append({'date': value.isoformat()})
+        elif isinstance(value, Decimal):
+            items.append({'decimal': str(value)})
+        else:
+            items.append(value)
+
+    raw = json.dumps(items, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    This function decodes a cursor token made by `encode_cursor`.
+
+    :param str cursor: The cursor token
+
+    :raise ValueError: If the cursor is malformed
+
+    :return list: The values
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        items = json.loads(raw.decode('utf-8'))
+        if not isinstance(items, list):
+            raise ValueError
+
+        values = []
+        for item in items:
+            if isinstance(item, dict):
+                if 'datetime' in item:
+                    item = datetime.fromisoformat(item['datetime'])
+                elif 'date' in item:
+                    item = date.fromisoformat(item['date'])
+                elif 'decimal' in item:
+                    item = Decimal(item['decimal'])
+                else:
+                    raise ValueError
+            values.append(item)
+    except (TypeError, ValueError, ArithmeticError) as e:
+        raise ValueError('Invalid cursor: {}'.format(e))
+
+    return values
+
+
 def add_pagination(query_params, default_page=1, default_page_size=100):
     # Pagination stuff
     page = query_params.get('page', default_page)
@@ -582,6 +1052,13 @@ def add_urls(blueprint, resource_classes):
     This allows us to group requests and HTTP method handlers ins
     classes with each method handler as a function.
 
+    If a resource class has an `etag_model` (a model or a tuple of models
+    having a `version_store`), its `get_all` and `get` are validated with the
+    version tokens of the models: the ETag is derived from the tokens and
+    the user (`request.user`, else the `Authorization` header), and when the
+    `If-None-Match` of the request matches it, `304 Not Modified` is returned
+    without calling the handler.
+
     :param Blueprint blueprint: The blueprint to which the routes are
         to be attached
     :param list(object) resource_classes: The user defined resource classes
@@ -589,12 +1066,15 @@ def add_urls(blueprint, resource_classes):
 
     for cls in resource_classes:
         cls_name = cls.__name__
+        etag_models = getattr(cls, 'etag_model', None)
+        if etag_models is not None and not isinstance(etag_models, tuple):
+            etag_models = (etag_models,)
 
         if hasattr(cls, 'get_all'):
             blueprint.add_url_rule(
                 cls.collection_route,
                 cls_name + '_get_all',
-                view_func=cls.get_all,
+                view_func=_get_versioned_view(cls.get_all, etag_models),
                 methods=['GET']
             )
         if hasattr(cls, 'post'):
@@ -608,7 +1088,7 @@ def add_urls(blueprint, resource_classes):
             blueprint.add_url_rule(
                 cls.resource_route,
                 cls_name + '_get',
-                view_func=cls.get,
+                view_func=_get_versioned_view(cls.get, etag_models),
                 methods=['GET']
             )
         if hasattr(cls, 'patch'):
@@ -627,19 +1107,431 @@ def add_urls(blueprint, resource_classes):
             )
 
 
+def _get_versioned_view(view_func, models):
+    """
+    Wraps a view so that it is validated with the version tokens of the
+    models, see `add_urls`.
+    """
+
+    if not models:
+        return view_func
+
+    @functools.wraps(view_func)
+    def wrapper(*args, **kwargs):
+        tokens = [model.get_version_token() for model in models]
+        if None in tokens:
+            return view_func(*args, **kwargs)
+
+        # The tokens are read before the handler queries, so a write in
+        # between makes the ETag older, never newer, than the body. The body
+        # may depend on the user, who is part of the ETag too.
+        tokens.append(get_user_identity() or 'anonymous')
+        etag = 'v' + get_etag(':'.join(tokens).encode('utf-8'))
+
+        matched_etag = get_matched_etag(etag)
+        if matched_etag is not None:
+            response = Response(status=304)
+            response.set_etag(matched_etag)
+        else:
+            response = app.make_response(view_func(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag)
+
+        response.vary.add('Authorization')
+        return response
+
+    return wrapper
+
+
+def get_user_identity():
+    """
+    Identifies the user of the request, by `request.user` if the app sets it,
+    else by (a hash of) the `Authorization` header.
+
+    :return str: None if the request has neither
+    """
+
+    user = getattr(request, 'user', None)
+    if user is not None and getattr(user, 'id_', None) is not None:
+        return 'user:{}'.format(user.id_)
+
+    authorization = request.headers.get('Authorization')
+    if authorization:
+        return 'authorization:{}'.format(
+            get_etag(authorization.encode('utf-8'))
+        )
+
+    return None
+
+
+def get_etag(data):
+    """
+    Returns a strong ETag of the data.
+
+    :param bytes data: The body
+
+    :return str:
+    """
+
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def get_matched_etag(etag, if_none_match=None):
+    """
+    Checks an ETag against the `If-None-Match` header of the request. The
+    ETags of the compressed variants of the body (with the `-<encoding>`
+    suffix added by `ApiFlask`) match too.
+
+    :param str etag: The ETag of the uncompressed body
+    :param ETags if_none_match: The parsed header, the one of the request by
+        default
+
+    :return str: The ETag the client has, to be sent back with the `304`,
+        None if it doesn't match
+    """
+
+    if if_none_match is None:
+        if_none_match = request.if_none_match
+    if not if_none_match:
+        return None
+
+    if if_none_match.star_tag or if_none_match.contains_weak(etag):
+        return etag
+
+    for encoding in compression.COMPRESSORS:
+        encoded_etag = '{}-{}'.format(etag, encoding)
+        if if_none_match.contains_weak(encoded_etag):
+            return encoded_etag
+
+    return None
+
+
+def is_etag_matched(etag, if_none_match=None):
+    """
+    Same as `get_matched_etag`, returning a boolean.
+
+    :return bool:
+    """
+
+    return get_matched_etag(etag, if_none_match) is not None
+
+
+class RawJSON():
+    """
+    Already encoded JSON, which `json_dumps` writes as it is instead of
+    encoding it again. It can be returned by a view, or be a part of the
+    data of a response, eg. `responsify(RawJSON(cached_bytes))`.
+    """
+
+    def __init__(self, data, http_status=200):
+        """
+        :param bytes data: The encoded JSON
+        :param int http_status: The status code, when returned by a view
+        """
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        self.data = data
+        self.http_status = http_status
+
+
+# Strings the `RawJSON` objects are replaced with while encoding, and the
+# pattern to find them back in the encoded JSON
+_RAW_JSON_MARKER = '\x00zephony-raw-json:'
+_RAW_JSON_PATTERN = re.compile(rb'"\\u0000zephony-raw-json:(\d+)"')
+
+
+def _encode_json_default(obj):
+    """
+    Encodes the values that are not natively supported by the JSON encoders.
+    """
+
+    # Dates, datetimes and times
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if isinstance(obj, (Decimal, UUID)):
+        return str(obj)
+
+    raise TypeError('Object of type {} is not JSON serializable'.format(
+        type(obj).__name__
+    ))
+
+
+def json_dumps(obj, backend=None):
+    """
+    Encodes an object to JSON with orjson if it is installed, else with the
+    json module. Both of them encode the dates and datetimes with
+    `isoformat()`, and Decimals and UUIDs as strings. `RawJSON` values are
+    written as they are.
+
+    :param object obj: The object to encode
+    :param str backend: `'orjson'` or `'json'`, the fastest one available by
+        default
+
+    :return bytes:
+    """
+
+    if backend is None:
+        backend = 'orjson' if orjson is not None else 'json'
+
+    fragments = []
+
+    def default(o):
+        if isinstance(o, RawJSON):
+            fragments.append(o.data)
+            return '{}{}'.format(_RAW_JSON_MARKER, len(fragments) - 1)
+        return _encode_json_default(o)
+
+    if isinstance(obj, RawJSON):
+        return obj.data
+
+    encoded = None
+    if backend == 'orjson':
+        try:
+            encoded = orjson.dumps(
+                obj,
+                default=default,
+                option=orjson.OPT_NON_STR_KEYS,
+            )
+        except TypeError:
+            # Integers over 64 bits are only supported by the json module
+            fragments = []
+    elif backend != 'json':
+        raise ValueError('`{}`: Unsupported JSON backend'.format(backend))
+
+    if encoded is None:
+        encoded = json.dumps(
+            obj,
+            default=default,
+            separators=(',', ':'),
+            ensure_ascii=False,
+        ).encode('utf-8')
+
+    if fragments:
+        encoded = _RAW_JSON_PATTERN.sub(
+            lambda match: fragments[int(match.group(1))],
+            encoded,
+        )
+
+    return encoded
+
+
 class ApiFlask(Flask):
     """
     ApiFlask is inherited from the Flask class to override the make_response
     function to automatically convert a returned dictionary to a JSON response.
+
+    The JSON backend can be chosen with the `JSON_BACKEND` config, see
+    `json_dumps`, or `json_dumps` be overridden in a subclass.
+
+    When the data of the dictionary is a generator, the response is streamed:
+    the items are encoded as they are generated and sent in chunks of about
+    `JSON_STREAM_CHUNK_SIZE` bytes.
+
+    The responses are compressed with the encoding negotiated from the
+    `Accept-Encoding` header, see `zephony.compression`. The compression is
+    configured with:
+        - `COMPRESS_ENABLED`: True by default
+        - `COMPRESS_ALGORITHMS`: The encodings in the order of preference,
+          `('zstd', 'br', 'gzip')` by default, the ones not installed being
+          skipped
+        - `COMPRESS_MIN_SIZE`: Bodies smaller than this, in bytes, are not
+          compressed, 500 by default. Streamed bodies are always compressed.
+        - `COMPRESS_LEVEL`, `COMPRESS_BR_LEVEL`, `COMPRESS_ZSTD_LEVEL`: The
+          levels of gzip, brotli and zstd
+        - `COMPRESS_MIMETYPES`: The mimetypes to compress
+    The bytes before and after the compression are counted in
+    `compression_stats`.
+
+    The JSON responses to GET requests get a strong ETag, the hash of the
+    body, unless they already have one, and are turned into `304 Not
+    Modified` when the `If-None-Match` of the request matches it. The ETag
+    of a compressed body has the encoding appended, eg. `"<hash>-gzip"`.
+    Set `ETAG_ENABLED` to False to disable them.
     """
 
+    # Items encoded at once in a streamed response
+    stream_batch_size = 100
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compression_stats = {
+            'responses': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+        }
+        self._compression_stats_lock = threading.Lock()
+
+    def json_dumps(self, obj):
+        return json_dumps(obj, backend=self.config.get('JSON_BACKEND'))
+
+    def _stream_json(self, rv):
+        """
+        Encodes the dictionary around its data once, and yields it with the
+        items of the data encoded in between.
+        """
+
+        items = rv['data']
+        envelope = dict(rv)
+        # Control characters are escaped by the encoders, so the byte cannot
+        # be anywhere else in the encoded envelope
+        envelope['data'] = RawJSON(b'\x00')
+        prefix, suffix = self.json_dumps(envelope).split(b'\x00')
+
+        chunk_size = self.config.get('JSON_STREAM_CHUNK_SIZE', 64 * 1024)
+        buffer = bytearray(prefix)
+        buffer += b'['
+        first = True
+        for batch in get_chunks(items, self.stream_batch_size):
+            if not first:
+                buffer += b','
+            first = False
+
+            # Encoded as a list, without the brackets
+            buffer += self.json_dumps(batch)[1:-1]
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+
+        buffer += b']'
+        buffer += suffix
+        yield bytes(buffer)
+
     def make_response(self, rv):
+        if isinstance(rv, RawJSON):
+            return Response(
+                rv.data,
+                status=rv.http_status,
+                mimetype='application/json',
+            )
+        if isinstance(rv, dict) and isinstance(rv.get('data'), Iterator):
+            return Response(
+                stream_with_context(self._stream_json(rv)),
+                status=rv['http_status'],
+                mimetype='application/json',
+            )
         if isinstance(rv, dict):
             return Response(
-                json.dumps(rv),
+                self.json_dumps(rv),
                 status=rv['http_status'],
                 mimetype='application/json',
             )
         return Flask.make_response(self, rv)
 
+    def process_response(self, response):
+        response = super().process_response(response)
+        if self.config.get('ETAG_ENABLED', True):
+            self._add_etag(response)
+        if self.config.get('COMPRESS_ENABLED', True):
+            self._compress_response(response)
+        return response
+
+    def _add_etag(self, response):
+        if request.method not in ('GET', 'HEAD') \
+                or response.status_code != 200 \
+                or response.is_streamed \
+                or response.direct_passthrough:
+            return
+
+        etag, weak = response.get_etag()
+        if etag is None:
+            if response.mimetype != 'application/json':
+                return
+            etag = get_etag(response.get_data())
+            response.set_etag(etag)
+
+        matched_etag = get_matched_etag(etag) if not weak else None
+        if matched_etag is not None:
+            # Same ETag as the one of the 200, compressed or not
+            response.status_code = 304
+            response.set_data(b'')
+            response.headers.pop('Content-Length', None)
+            response.set_etag(matched_etag)
+
+    def _compress_response(self, response):
+        mimetypes = self.config.get('COMPRESS_MIMETYPES', _COMPRESS_MIMETYPES)
+        if response.mimetype not in mimetypes:
+            return
+
+        # The body depends on the Accept-Encoding header from here
+        response.vary.add('Accept-Encoding')
+
+        if response.status_code < 200 or response.status_code in (204, 206, 304) \
+                or response.direct_passthrough \
+                or 'Content-Encoding' in response.headers:
+            return
+
+        if not response.is_streamed:
+            min_size = self.config.get('COMPRESS_MIN_SIZE', 500)
+            if response.content_length is not None \
+                    and response.content_length < min_size:
+                return
+
+        encoding = compression.negotiate_encoding(
+            request.accept_encodings,
+            compression.get_available_encodings(self.config.get(
+                'COMPRESS_ALGORITHMS',
+                ('zstd', 'br', 'gzip'),
+            )),
+        )
+        if encoding is None:
+            return
+
+        if response.is_streamed:
+            response.response = compression.iter_compressed(
+                response.response,
+                compression.get_compressor(encoding, self.config),
+                on_finish=self._count_compressed_bytes,
+            )
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            compressed = compression.compress(data, encoding, self.config)
+            response.set_data(compressed)
+            self._count_compressed_bytes(len(data), len(compressed))
+
+        response.headers['Content-Encoding'] = encoding
+
+        # A compressed body is a different representation
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag('{}-{}'.format(etag, encoding))
+
+    def _count_compressed_bytes(self, bytes_in, bytes_out):
+        with self._compression_stats_lock:
+            self.compression_stats['responses'] += 1
+            self.compression_stats['bytes_in'] += bytes_in
+            self.compression_stats['bytes_out'] += bytes_out
+
+    def get_compression_stats(self):
+        """
+        Returns the counters of the compressed responses, with the bytes
+        saved.
+
+        :return dict:
+        """
+
+        with self._compression_stats_lock:
+            stats = dict(self.compression_stats)
+
+        stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        stats['ratio'] = stats['bytes_out'] / stats['bytes_in'] \
+            if stats['bytes_in'] else None
+        return stats
+
+
+# Mimetypes compressed by `ApiFlask` by default
+_COMPRESS_MIMETYPES = (
+    'application/json',
+    'application/javascript',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+    'text/xml',
+)
+
 
@@ -1,13 +1,44 @@
+import collections
+import contextlib
 import datetime
+import decimal
+import io
+import json
 import logging
+import math
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import desc, or_, cast, func
+from sqlalchemy import (
+    event, and_, any_, bindparam, desc, or_, cast, func, inspect, select,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import (
+    Session,
+    defaultload,
+    joinedload,
+    load_only,
+    selectinload,
+    subqueryload,
+)
+from sqlalchemy.sql.sqltypes import NullType
 
 from zephony.exceptions import InvalidRequestData
 
 from zephony.helpers import(
-    get_rows_from_csv,
+    decode_cursor,
+    encode_cursor,
+    generate_checksum_of_file,
+    get_chunks,
+    get_csv_byte_ranges,
+    iter_columns_from_csv,
+    iter_rows_from_csv,
+    iter_rows_from_csv_range,
+    iter_rows_from_workbook,
     serialize_datetime,
 )
 
@@ -25,6 +56,50 @@ class BaseModel(db.Model):
     created_at = db.Column(db.DateTime, server_default=func.now())
     deleted_at = db.Column(db.DateTime)
 
+    # Opt-in cache of the serialized details, keyed by (model, id, level).
+    # Set it to a backend from `zephony.cache`, eg. MemoryCache(ttl=300).
+    # Entries are invalidated by `update`, `soft_delete` and whenever the
+    # object is flushed with changes, and again when the transaction is
+    # committed or rolled back. Uncommitted changes are never cached. Details
+    # that include related objects are not invalidated when those change,
+    # rely on the TTL for them.
+    details_cache = None
+
+    # Opt-in cache of token -> id for the token lookups of `get_one`, which
+    # then load the object by primary key, from the identity map if it is
+    # already in the session. Set it to a bounded backend from
+    # `zephony.cache`, eg. MemoryCache(maxsize=100000); its `get_stats` gives
+    # the hit and miss counters. Entries are dropped when the token or the
+    # status of the object changes.
+    token_cache = None
+
+    # Opt-in store of a version token per model, changed whenever a
+    # transaction writing objects of the model (including the bulk writes)
+    # is committed. Set it to a backend from `zephony.cache`, shared between
+    # the processes (StoreCache) if there are several. It allows the
+    # responses to be validated with the token alone, see `add_urls`.
+    version_store = None
+
+    # The columns each level of `get_details` reads, eg.
+    # {'INFO': ('token', 'name'), 'BASIC': ('token', 'name', 'created_at')}
+    # When a level is declared, the list helpers load only those columns
+    # (and the primary key) when `get_details` is set. Any other column is
+    # loaded lazily, one query per object, so keep the lists complete.
+    details_columns = {}
+
+    # The relationships each level of `get_details` reads, with the strategy
+    # to load them with: 'selectin', 'joined' or 'subquery'. Nested
+    # relationships are separated by dots, eg.
+    # {'FULL': {'company': 'joined', 'roles': 'selectin',
+    #           'roles.permissions': 'selectin'}}
+    details_relationships = {}
+
+    # Debug mode. Set `BaseModel.lazy_load_check` to 'warn' or 'raise' to
+    # detect lazy loads while `get_objects_details` serializes the objects,
+    # which means a column or relationship is missing from the declarations
+    # above.
+    lazy_load_check = None
+
     def _type(self):
         """
         Get the derived class' name. This method isn't being used anywhere
@@ -34,11 +109,21 @@ class BaseModel(db.Model):
         return self.__class__.__name__
 
     @staticmethod
-    def _add_key_from_csv_row(data, k, v, row):
+    def _add_key_from_csv_row(data, k, v, row, context=None):
         if type(v) == tuple:
             if len(v) == 1:  # Value hardcoded right in the index being sent
                 data[k] = v[0]
             elif len(v) == 2:  # Value has to be type casted
+                # Value already casted by the typed reader
+                if not isinstance(row[v[0]], str):
+                    if row[v[0]] is None:
+                        return
+                    if v[1] is int:
+                        data[k] = int(row[v[0]])
+                    else:
+                        data[k] = row[v[0]].isoformat()
+                    return
+
                 # Do nothing if value is empty
                 if not row[v[0]].strip():
                     return
@@ -65,6 +150,10 @@ class BaseModel(db.Model):
                     raise ValueError('`{}`: Unsupported type to type case to'.format(v[1]))
             elif len(v) == 3:
                 if v[2] == 'power_of_2':  # Used for permissions to calculate & store permission bit
+                    if not isinstance(row[v[0]], str):
+                        data[k] = str(row[v[0]])
+                        return
+
                     # Permission bit cannot be empty
                     if not row[v[0]].strip():
                         raise ValueError('Permission bit value cannot be empty')
@@ -74,14 +163,20 @@ class BaseModel(db.Model):
 
                     data[k] = str(2 ** (int(row[v[0]]) - 1))
                 elif v[2] == 'boolean':
-                    if row[v[0]].strip() == 'x':
+                    if not isinstance(row[v[0]], str):
+                        data[k] = bool(row[v[0]])
+                    elif row[v[0]].strip() == 'x':
                         data[k] = True
                     else:
                         data[k] = False
                 elif v[2] == 'permission_tokens':
-                    # Queries permissions table
-                    from .permission import Permission
-                    permissions_map = Permission.get_map()
+                    # Queries permissions table, once per import if a context
+                    # is given
+                    if context is not None:
+                        permissions_map = context.get_permissions_map()
+                    else:
+                        from .permission import Permission
+                        permissions_map = Permission.get_map()
 
                     permission_bit_sequence = 0
                     # Split by comma
@@ -94,6 +189,10 @@ class BaseModel(db.Model):
                 elif v[2] == 'foreign_key':  # For foreign key relationships
                     cls = v[1]
 
+                    if context is not None:
+                        data[k] = context.get_foreign_key_id(cls, row[v[0]])
+                        return
+
                     # Query and get the object ID, if found, else, create new entry in the database and return the ID.
                     obj = cls.query.filter_by(
                         original_name=row[v[0]],
@@ -116,136 +215,82 @@ class BaseModel(db.Model):
             data[k] = row[v]
 
     @staticmethod
-    def _get_filtered_query(q, fields, filters):
-        logger.info(filters)
-        for f in filters:
-            if f['name'] in fields:
+    def _compile_filter_plan(fields):
+        """
+        Compiles the `fields` spec of a resource into a dispatch table of
+        field name -> operator -> function. Each function takes the list of
+        values of a filter and returns the filter expression, the column
+        expressions are built here once rather than for every request. The
+        fields that are not attributes of their class are left out.
 
-                attribute = fields[f['name']].get('field', f['name'])
+        :param dict fields: Map of fields allowed for filtering
 
-                filter_attribute = getattr(
-                    fields[f['name']]['cls'],
-                    attribute
-                )
+        :return dict:
+        """
 
-                if fields[f['name']]['type'] == 'TEXT':
-                    if 'cast' in fields[f['name']] and fields[f['name']]['cast']:
-                        filter_attribute = cast(filter_attribute, db.String)
-                    for filter_ in f['filters']:
-                        if filter_['operator'] == 'starts_with':
-                            q = q.filter(
-                                or_(*[
-                                    (filter_attribute.ilike(v+'%') for v in filter_['value'])
-                                ])
-                            )
-                        elif filter_['operator'] == 'ends_with':
-                            q = q.filter(
-                                or_(*[
-                                    (filter_attribute.ilike('%'+v) for v in filter_['value'])
-                                ])
-                            )
-                        elif filter_['operator'] == 'contains':
-                            q = q.filter(
-                                or_(*[
-                                    (filter_attribute.ilike('%'+v+'%') for v in filter_['value'])
-                                ])
-                            )
-                        elif filter_['operator'] == 'equals':
-                            q = q.filter(
-                                or_(*[
-                                    (func.lower(filter_attribute) == v.lower() for v in filter_['value'])
-                                ])
-                            )
-                        else:
-                            logger.warn(
-                                'Invalid operator {}. Ignoring.'.format(
-                                    filter_['operator']
-                                )
-                            )
-                            # raise Exception(
-                            #     'Invalid operator {}'.format(f['operator'])
-                            # )
-
-                if fields[f['name']]['type'] == 'INT':
-                    for filter_ in f['filters']:
-                        if filter_['operator'] == 'lesser_than':
-                            q = q.filter(
-                                or_(*[
-                                    (filter_attribute < v for v in filter_['value'])
-                                ])
-                            )
-                        elif filter_['operator'] == 'greater_than':
-                            q = q.filter(
-                                or_(*[
-                                    (filter_attribute > v for v in filter_['value'])
-                                ])
-                            )
-                        elif filter_['operator'] == 'equals':
-                            q = q.filter(
-                                or_(*[
-                                    (filter_attribute == v for v in filter_['value'])
-                                ])
-                            )
-                        else:
-                            logger.warn(
-                                'Invalid operator {}. Ignoring.'.format(
-                                    filter_['operator']
-                                )
-                            )
-                            # raise Exception(
-                            #     'Invalid operator {}'.format(f['operator'])
-                            # )
-
-                if fields[f['name']]['type'] == 'BOOL' or fields[f['name']]['type'] == 'ENUM':
-                    for filter_ in f['filters']:
-                        if filter_['operator'] == 'equals':
-                            q = q.filter(
-                                or_(*[
-                                    (filter_attribute == v for v in filter_['value'])
-                                ])
-                            )
-                        else:
-                            logger.warn(
-                                'Invalid operator {}. Ignoring.'.format(
-                                    filter_['operator']
-                                )
-                            )
-                            # raise Exception(
-                            #     'Invalid operator {}'.format(f['operator'])
-                            # )
-
-                if fields[f['name']]['type'] == 'DATE':
-                    for filter_ in f['filters']:
-                        if filter_['operator'] == 'from':
-                            q = q.filter(
-                                or_(*[
-                                    (func.date(filter_attribute) >= v for v in filter_['value'])
-                                ])
-                            )
-                        elif filter_['operator'] == 'to':
-                            q = q.filter(
-                                or_(*[
-                                    (func.date(filter_attribute) <= v for v in filter_['value'])
-                                ])
-                            )
-                        elif filter_['operator'] == 'equals':
-                            q = q.filter(
-                                or_(*[
-                                    (filter_attribute == v for v in filter_['value'])
-                                ])
-                            )
-                        else:
-                            logger.warn(
-                                'Invalid operator {}. Ignoring.'.format(
-                                    filter_['operator']
-                                )
-                            )
-                            # raise Exception(
-                            #     'Invalid operator {}'.format(f['operator'])
-                            # )
-            else:
+        plan = {}
+        for name, field in fields.items():
+            # Eg. the JSON paths (`a.b`) of a spec also used for sorting
+            attribute = getattr(field.get('cls'), field.get('field', name), None)
+            if attribute is None:
+                logger.debug('`{}` is not an attribute, cannot be filtered'.format(name))
+                continue
+
+            if field.get('type') == 'TEXT' and field.get('cast'):
+                attribute = cast(attribute, db.String)
+
+            operators = _FILTER_OPERATORS.get(field.get('type'), {})
+            plan[name] = {
+                operator: factory(attribute)
+                for operator, factory in operators.items()
+            }
+
+        return plan
+
+    @staticmethod
+    def _get_filter_plan(fields):
+        """
+        Returns the compiled filter plan of the `fields` spec, compiling it on
+        first use. Plans are cached by the identity of the dictionary, so the
+        spec shouldn't be modified once it has been used.
+        """
+
+        key = id(fields)
+        entry = _filter_plans.get(key)
+        if entry is None or entry[0] is not fields:
+            # Keep a reference to the spec so that the id isn't reused
+            entry = (fields, BaseModel._compile_filter_plan(fields))
+            _filter_plans[key] = entry
+            if len(_filter_plans) > _FILTER_PLANS_MAX_SIZE:
+                _filter_plans.popitem(last=False)
+
+        return entry[1]
+
+    @staticmethod
+    def _get_filtered_query(q, fields, filters):
+        logger.debug(filters)
+        plan = BaseModel._get_filter_plan(fields)
+        for f in filters:
+            operators = plan.get(f['name'])
+            if operators is None:
                 logger.warn('Invalid param {}. Ignoring.'.format(f['name']))
                 # raise Exception('Invalid param {}'.format(f['name']))
+                continue
+
+            for filter_ in f['filters']:
+                get_expression = operators.get(filter_['operator'])
+                if get_expression is None:
+                    logger.warn(
+                        'Invalid operator {}. Ignoring.'.format(
+                            filter_['operator']
+                        )
+                    )
+                    # raise Exception(
+                    #     'Invalid operator {}'.format(f['operator'])
+                    # )
+                    continue
+
+                q = q.filter(get_expression(filter_['value']))
 
         return q
 
@@ -265,6 +310,24 @@ class BaseModel(db.Model):
                     'operator': 'equals',
                     'value': [query_params[key]]
                 })
+            elif results[-2] == 'in':
+                # Takes comma separated values, and repeated params if the
+                # query params are a MultiDict (request.args)
+                if hasattr(query_params, 'getlist'):
+                    params = query_params.getlist(key)
+                else:
+                    params = [query_params[key]]
+
+                values = []
+                for param in params:
+                    values.extend(
+                        v.strip() for v in str(param).split(',') if v.strip()
+                    )
+
+                filters_details[results[-1]].append({
+                    'operator': 'in',
+                    'value': values,
+                })
             else:
                 filters_details[results[-1]].append({
                     'operator': results[-2],
@@ -281,6 +344,40 @@ class BaseModel(db.Model):
 
         return filters_list
 
+    @staticmethod
+    def _parse_reverse(reverse):
+        """
+        Converts the `reverse` query param (or a bool) into a bool.
+        """
+
+        if reverse is True:
+            return True
+
+        try:
+            return reverse.lower() in ('1', 'true')
+        except (TypeError, ValueError, AttributeError):
+            return False
+
+    @staticmethod
+    def _get_order_attribute(allowed_fields, order_by):
+        """
+        Returns the column expression to sort by, or None if `order_by` is not
+        one of the allowed fields.
+        """
+
+        if not order_by or order_by not in allowed_fields:
+            return None
+
+        if '.' in order_by:
+            segments = order_by.split('.')
+            param = getattr(allowed_fields[order_by]['cls'], segments[0])
+            for segment in segments[1:]:
+                param = param[segment]
+        else:
+            param = getattr(allowed_fields[order_by]['cls'], order_by)
+
+        return param
+
     @staticmethod
     def _get_ordered_query(q, allowed_fields, order_by=None, reverse=False):
         """
@@ -293,23 +390,11 @@ class BaseModel(db.Model):
 
         :return str: Constructed query
         """
-        try:
-            if reverse.lower() in ('1', 'true'):
-                reverse = True
-            else:
-                reverse = False
-        except (TypeError, ValueError, AttributeError):
-            reverse = False
-
-        if order_by and order_by in allowed_fields:
-            if '.' in order_by:
-                segments = order_by.split('.')
-                param = getattr(allowed_fields[order_by]['cls'], segments[0])
-                for segment in segments[1:]:
-                    param = param[segment]
-            else:
-                param = getattr(allowed_fields[order_by]['cls'], order_by)
 
+        reverse = BaseModel._parse_reverse(reverse)
+
+        param = BaseModel._get_order_attribute(allowed_fields, order_by)
+        if param is not None:
             if reverse:
                 param = desc(param)
 
@@ -356,6 +441,243 @@ class BaseModel(db.Model):
 
         return q
 
+    @staticmethod
+    def _parse_page_size(page_size):
+        """
+        Returns the page size as an int, defaulting to 100 if invalid.
+        """
+
+        try:
+            page_size = int(page_size)
+            if page_size <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            page_size = 100
+
+        return page_size
+
+    @staticmethod
+    def _get_approximate_count(q):
+        """
+        Returns the planner's estimate of the number of rows of the query.
+        Only PostgreSQL is supported, None is returned for other databases.
+
+        :param q query: Constructed query
+
+        :return int or None:
+        """
+
+        entity = q.column_descriptions[0]['entity']
+        connection = db.session.connection(
+            bind_arguments={'mapper': inspect(entity)}
+        )
+        if connection.dialect.name != 'postgresql':
+            return None
+
+        compiled = q.order_by(None).statement.compile(
+            dialect=connection.dialect,
+            compile_kwargs={'render_postcompile': True},
+        )
+        plan = connection.exec_driver_sql(
+            'EXPLAIN (FORMAT JSON) {}'.format(compiled),
+            compiled.params,
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    @classmethod
+    def get_paginated(cls, fields=None, filters=None, order_by=None,
+            reverse=False, page=1, page_size=100, q=None,
+            sortable_fields=None, approximate_count=False):
+        """
+        Returns a page of the objects along with the total count of the
+        filtered rows, combining `_get_filtered_query`, `_get_ordered_query`
+        and `_get_paginated_query`. The total is fetched in the same
+        statement as the page with `count(*) OVER ()`, only a page past the
+        end needs a separate count.
+
+        With `approximate_count`, the total is the planner's estimate instead,
+        which is much cheaper on huge tables (PostgreSQL only, other
+        databases get the exact count).
+
+        Window functions are computed before DISTINCT, so pass
+        `approximate_count` or count separately for DISTINCT queries.
+
+        :param dict fields: Map of fields allowed for filtering
+        :param list filters: Filters, as returned by
+            `_construct_filters_from_query_params`
+        :param str order_by: Order by field
+        :param bool reverse: Flag to sort descending
+        :param int page: Page number
+        :param int page_size: Page size
+        :param query q: Base query, defaults to all the objects of the class
+        :param dict sortable_fields: Map of fields allowed for sorting,
+            defaults to `fields`
+        :param bool approximate_count: Estimate the total instead of counting
+
+        :return dict: Objects, total count, and the pagination tuple for
+            `responsify`
+        """
+
+        if q is None:
+            q = cls.query
+
+        if filters:
+            q = cls._get_filtered_query(q, fields or {}, filters)
+
+        q = cls._get_ordered_query(
+            q,
+            sortable_fields if sortable_fields is not None else fields or {},
+            order_by,
+            reverse,
+        )
+
+        try:
+            page = int(page)
+            if page <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            page = 1
+        page_size = cls._parse_page_size(page_size)
+        paginated_q = cls._get_paginated_query(q, page, page_size)
+
+        total_count = None
+        if approximate_count:
+            total_count = cls._get_approximate_count(q)
+
+        if total_count is not None:
+            objects = paginated_q.all()
+        else:
+            rows = paginated_q.add_columns(
+                func.count().over().label('total_count')
+            ).all()
+            objects = [row[0] for row in rows]
+            if rows:
+                total_count = rows[0][-1]
+            elif page > 1:
+                # The window is empty past the last page
+                total_count = q.order_by(None).count()
+            else:
+                total_count = 0
+
+        total_pages = int(math.ceil(total_count / page_size))
+
+        return {
+            'objects': objects,
+            'total_count': total_count,
+            'pagination': (page, page_size, total_pages),
+        }
+
+    @staticmethod
+    def _get_cursor_paginated_query(q, allowed_fields, cursor=None,
+            page_size=None, order_by=None, reverse=False):
+        """
+        Function to add keyset (cursor) pagination to the given query. Unlike
+        `_get_paginated_query`, the cost of a page doesn't depend on how deep
+        it is. The rows are sorted by the `order_by` field, with the id as the
+        tie-breaker, and the page starts right after the row the cursor was
+        made from. Use this instead of `_get_ordered_query`.
+
+        One row more than the page size is fetched, pass the results to
+        `_get_next_cursor` to get the page and the cursor of the next one.
+
+        The sort field has to be a column of the queried class. Sorting by
+        JSON fields (`a.b`) is not supported, such queries are sorted by id.
+        Rows having NULL in the sort column are sorted last.
+
+        :param q query: Constructed query
+        :param allowed_fields dict: Map of fields allowed for sorting
+        :param cursor str: The `next_cursor` of the previous page, if any
+        :param page_size int: Page size
+        :param order_by str: Order by field
+        :param reverse bool: Flag to decide whether to sort ascending or descending
+
+        :return query: Constructed query
+        """
+
+        page_size = BaseModel._parse_page_size(page_size)
+        reverse = BaseModel._parse_reverse(reverse)
+
+        id_ = q.column_descriptions[0]['entity'].id_
+        param = BaseModel._get_order_attribute(allowed_fields, order_by)
+        if param is not None and '.' in order_by:
+            logger.warning(
+                'Cannot paginate by cursor on `{}`, sorting by id'.format(order_by)
+            )
+            param = None
+
+        if cursor:
+            try:
+                values = decode_cursor(cursor)
+                if len(values) != (1 if param is None else 2):
+                    raise ValueError
+                # Tampered values would fail in the database instead
+                if type(values[-1]) is not int:
+                    raise ValueError
+                if param is not None and values[0] is not None \
+                        and not _is_cursor_value_valid(param, values[0]):
+                    raise ValueError
+            except ValueError:
+                raise InvalidRequestData([{
+                    'field': 'cursor',
+                    'description': 'Invalid cursor',
+                }])
+
+            if param is None:
+                q = q.filter(id_ < values[0] if reverse else id_ > values[0])
+            else:
+                value, last_id = values
+                after_id = id_ < last_id if reverse else id_ > last_id
+                if value is None:
+                    # Only the other NULL rows come after a NULL
+                    q = q.filter(param.is_(None), after_id)
+                else:
+                    q = q.filter(or_(
+                        param < value if reverse else param > value,
+                        and_(param == value, after_id),
+                        param.is_(None),
+                    ))
+
+        if param is not None:
+            q = q.order_by(
+                (desc(param) if reverse else param).nullslast()
+            )
+        q = q.order_by(desc(id_) if reverse else id_)
+
+        return q.limit(page_size + 1)
+
+    @staticmethod
+    def _get_next_cursor(objects, allowed_fields, page_size=None,
+            order_by=None):
+        """
+        Splits the results of a `_get_cursor_paginated_query` query into the
+        page and the cursor of the next page. The cursor is None on the last
+        page.
+
+        :param list objects: The fetched objects
+        :param allowed_fields dict: Map of fields allowed for sorting
+        :param page_size int: Page size
+        :param order_by str: Order by field
+
+        :return tuple: List of objects, next cursor
+        """
+
+        page_size = BaseModel._parse_page_size(page_size)
+
+        objects = list(objects)
+        if len(objects) <= page_size:
+            return objects, None
+
+        objects = objects[:page_size]
+        last = objects[-1]
+        if (BaseModel._get_order_attribute(allowed_fields, order_by) is None
+                or '.' in order_by):
+            return objects, encode_cursor([last.id_])
+
+        return objects, encode_cursor([getattr(last, order_by), last.id_])
+
     @classmethod
     def get_one(cls, id_or_token, status='active'):
         """
@@ -380,20 +702,23 @@ class BaseModel(db.Model):
 
         elif type(id_or_token) == str:
             # id_or_token contains the token
-            if status is None:
-                obj = cls.query.filter_by(token=id_or_token).first()
-                if obj is None:
-                    errors = [{
-                        'field': 'data.token',
-                        'description': 'token cannot be found',
-                    }]
-                    raise InvalidRequestData(errors)
-                return obj
-            print(id_or_token)
-            obj = cls.query.filter(
-                cls.token == id_or_token,
-                cls.status == status
-            ).first()
+            obj = cls._get_by_cached_token(id_or_token)
+            if obj is not None:
+                if status is not None and obj.status != status:
+                    obj = None
+            else:
+                q = cls.query.filter(cls.token == id_or_token)
+                if status is not None:
+                    q = q.filter(cls.status == status)
+                obj = q.first()
+
+                if obj is not None and cls.token_cache is not None \
+                        and not obj._has_uncommitted_changes():
+                    cls.token_cache.set(
+                        cls._get_token_cache_key(id_or_token),
+                        obj.id_,
+                    )
+
             if obj is None:
                 errors = [{
                     'field': 'data.token',
@@ -405,6 +730,103 @@ class BaseModel(db.Model):
         else:
             raise ValueError
 
+    @classmethod
+    def _get_token_cache_key(cls, token):
+        return '{}:token:{}'.format(cls.__tablename__, token)
+
+    @classmethod
+    def _get_by_cached_token(cls, token):
+        """
+        Returns the object of the token through the `token_cache`, by primary
+        key, which is served from the session's identity map when the object
+        is already loaded. Returns None if the token isn't cached.
+        """
+
+        cache = cls.token_cache
+        if cache is None:
+            return None
+
+        key = cls._get_token_cache_key(token)
+        id_ = cache.get(key)
+        if id_ is None:
+            return None
+
+        obj = cls.query.get(id_)
+        if obj is None or obj.token != token:
+            cache.delete(key)
+            return None
+
+        return obj
+
+    @classmethod
+    def get_many(cls, ids_or_tokens, status='active'):
+        """
+        Returns the objects for a list of ids and/or tokens, in the same order
+        as the list, with at most two queries. The ids and tokens that cannot
+        be found are reported together in a single InvalidRequestData.
+        Pass status=None if you do not want the status filter to be applied.
+
+        :param list ids_or_tokens: Ids (int) and/or tokens (str)
+        :param str status: The status the objects must have
+
+        :raise InvalidRequestData: If any of the ids or tokens is not found
+
+        :return list: Returns the list of objects
+        """
+
+        ids = set()
+        tokens = set()
+        for id_or_token in ids_or_tokens:
+            if type(id_or_token) == int:
+                ids.add(id_or_token)
+            elif type(id_or_token) == str:
+                tokens.add(id_or_token)
+            else:
+                raise ValueError
+
+        objects_by_id = {}
+        if ids:
+            q = cls.query.filter(cls.id_.in_(ids))
+            if status is not None:
+                q = q.filter(cls.status == status)
+            objects_by_id = {obj.id_: obj for obj in q}
+
+        objects_by_token = {}
+        if tokens:
+            q = cls.query.filter(cls.token.in_(tokens))
+            if status is not None:
+                q = q.filter(cls.status == status)
+            objects_by_token = {obj.token: obj for obj in q}
+
+        objects = []
+        errors = []
+        for id_or_token in ids_or_tokens:
+            if type(id_or_token) == int:
+                obj = objects_by_id.get(id_or_token)
+                field = 'id'
+            else:
+                obj = objects_by_token.get(id_or_token)
+                field = 'token'
+
+            if obj is None:
+                error = {
+                    'field': 'data.{}'.format(field),
+                    'description': '{} `{}` cannot be found'.format(
+                        field,
+                        id_or_token,
+                    ),
+                }
+                if error not in errors:
+                    errors.append(error)
+                continue
+
+            objects.append(obj)
+
+        if errors:
+            raise InvalidRequestData(errors)
+
+        return objects
+
     @classmethod
     def get_by_id_or_token(cls, id_or_token, status='active'):
         """
@@ -439,7 +861,10 @@ class BaseModel(db.Model):
         Returns all the objects from the database.
         Pass status=None if you do not want the status filter to be applied.
         """
-        objects = cls.query.filter_by(status='active').all()
+        q = cls.query.filter_by(status='active')
+        if get_details:
+            q = cls._get_details_query(q, level)
+        objects = q.all()
         #
         # Return the list of class objects, if the value of `get_details` is
         # set to False.
@@ -450,6 +875,64 @@ class BaseModel(db.Model):
             level
         ) if get_details else objects
 
+    @staticmethod
+    def _iter_query(q, chunk_size=1000):
+        """
+        Iterates over the results of the query fetching `chunk_size` rows at a
+        time, with a server side cursor where the database driver supports
+        it, instead of loading all of them first.
+
+        Relationships can't be eager loaded with `joined` while iterating this
+        way, use `selectin` instead.
+        """
+
+        q = q.execution_options(stream_results=True).yield_per(chunk_size)
+        for obj in q:
+            yield obj
+
+    @classmethod
+    def iter_all(cls, status='active', chunk_size=1000):
+        """
+        Generator version of `get_all`, which keeps only `chunk_size` rows in
+        memory at a time. Meant for jobs that go through big tables.
+        Pass status=None if you do not want the status filter to be applied.
+
+        :param str status: The status the objects must have
+        :param int chunk_size: Number of rows fetched at a time
+
+        :return generator:
+        """
+
+        q = cls.query
+        if status is not None:
+            q = q.filter_by(status=status)
+
+        return cls._iter_query(q, chunk_size)
+
+    @classmethod
+    def iter_all_active(cls, get_details=False, level='INFO',
+            chunk_size=1000):
+        """
+        Generator version of `get_all_active`, which keeps only `chunk_size`
+        rows in memory at a time. With `get_details`, the details are
+        yielded as the rows are fetched.
+
+        :param bool get_details: Set this flag to get the details instead of
+        the objects.
+        :param str level: This parameter indicates the level of information
+        required on the object.
+        :param int chunk_size: Number of rows fetched at a time
+
+        :return generator:
+        """
+
+        q = cls.query.filter_by(status='active')
+        if not get_details:
+            return cls._iter_query(q, chunk_size)
+
+        q = cls._get_details_query(q, level)
+        return cls.iter_objects_details(cls._iter_query(q, chunk_size), level)
+
     @classmethod
     def get_by_id(cls, id_, status):
         """
@@ -499,6 +982,8 @@ class BaseModel(db.Model):
             return []
 
         objects = cls.query.filter_by(**filters)
+        if get_details:
+            objects = cls._get_details_query(objects, level)
 
         # Return the list of class objects, if the value of `get_details` is
         # set to False.
@@ -533,7 +1018,10 @@ class BaseModel(db.Model):
             )
             return None
 
-        obj = cls.query.filter_by(**filters).first()
+        q = cls.query.filter_by(**filters)
+        if get_details:
+            q = cls._get_details_query(q, level)
+        obj = q.first()
 
         # Return the class object, if `get_details` is set to False.
         # Return the details of the class object, if `get_details` is set True
@@ -567,6 +1055,8 @@ class BaseModel(db.Model):
             return []
 
         objects = cls.query.filter(*filters)
+        if get_details:
+            objects = cls._get_details_query(objects, level)
 
         # Return the list of class objects, if the value of `get_details` is
         # set to False.
@@ -601,7 +1091,10 @@ class BaseModel(db.Model):
             )
             return None
 
-        obj = cls.query.filter(*filters).first()
+        q = cls.query.filter(*filters)
+        if get_details:
+            q = cls._get_details_query(q, level)
+        obj = q.first()
 
         # Return the class object, if `get_details` is set to False.
         # Return the details of the class object, if `get_details` is set True
@@ -609,24 +1102,91 @@ class BaseModel(db.Model):
             level
         ) if obj and get_details else obj
 
+    @classmethod
+    def _get_details_options(cls, level):
+        """
+        Returns the loader options needed to fetch the objects for the given
+        level of details, as declared in `details_columns`.
+
+        :param str level: The level of details required for the objects.
+
+        :return list:
+        """
+
+        options = []
+        columns = cls.details_columns.get(level)
+        if columns:
+            options.append(
+                load_only(*[getattr(cls, column) for column in columns])
+            )
+
+        relationships = cls.details_relationships.get(level, {})
+        for path, strategy in relationships.items():
+            if strategy not in _RELATIONSHIP_LOADERS:
+                raise ValueError(
+                    '`{}`: Invalid loading strategy for `{}`'.format(strategy, path)
+                )
+
+            # Intermediate relationships keep the strategy they are declared
+            # with, if any, otherwise their default one
+            loader = None
+            related = cls
+            segments = path.split('.')
+            for i, segment in enumerate(segments):
+                attribute = getattr(related, segment)
+                name = strategy if i == len(segments) - 1 else 'default'
+                if loader is None:
+                    loader = _RELATIONSHIP_LOADERS[name](attribute)
+                else:
+                    loader = getattr(loader, name + 'load')(attribute)
+                related = attribute.property.mapper.class_
+            options.append(loader)
+
+        return options
+
+    @classmethod
+    def _get_details_query(cls, q, level):
+        """
+        Applies the loader options of the level of details to the query.
+        """
+
+        options = cls._get_details_options(level)
+        return q.options(*options) if options else q
+
     def get_details(self, level='INFO'):
         """
         This method fetches the details of an object limiting the details to
         the given level.
         Levels starting from lower to higher - info, basic, full, extra
 
+        If the class has a `details_cache`, the details are served from it
+        when possible. A copy of the cached dictionary is returned, nested
+        values are shared and must not be modified. Objects having changes
+        not committed yet bypass the cache.
+
         :param str level: The level of details required for the object.
 
         :return dict: Returns the details of the object.
         """
 
-        # Possible levels. Just for quick reference.
-        LEVELS = (
-            'INFO',
-            'BASIC',
-            'FULL',
-            'EXTRA',
-        )
+        cache = self.details_cache
+        if cache is None or self.id_ is None \
+                or self._has_uncommitted_changes():
+            return self._get_details(level)
+
+        key = self._get_details_cache_key(self.id_, level)
+        details = cache.get(key)
+        if details is None:
+            details = self._get_details(level)
+            cache.set(key, details)
+
+        return dict(details)
+
+    def _get_details(self, level='INFO'):
+        """
+        Computes the details of the object for the given level, see
+        `get_details`.
+        """
 
         if level == 'INFO':
             return self.get_info()
@@ -701,11 +1261,25 @@ class BaseModel(db.Model):
         :return list:
         """
         # Return the details of the list of class objects
-        objects_details = []
-        for obj in objects:
-            objects_details.append(obj.get_details(level))
+        return list(BaseModel.iter_objects_details(objects, level))
+
+    @staticmethod
+    def iter_objects_details(objects, level='INFO'):
+        """
+        Generator version of `get_objects_details`. The objects are consumed
+        one by one as the details are yielded, so that the iterators of
+        `iter_all` and `iter_all_active` can be serialized with bounded
+        memory.
+
+        :param iterable objects: Objects of a class.
+        :param str level: Level of details to be returned.
+
+        :return generator(dict):
+        """
 
-        return objects_details
+        with _lazy_load_check(BaseModel.lazy_load_check):
+            for obj in objects:
+                yield obj.get_details(level)
 
     def update(self, data):
         """
@@ -717,6 +1291,8 @@ class BaseModel(db.Model):
         for key, value in data.items():
             setattr(self, key, value)
 
+        self._invalidate_caches()
+
         base_details = self.get_base_details()
         return {**base_details, **data}
 
@@ -733,62 +1309,934 @@ class BaseModel(db.Model):
         self.status = 'deleted'
         self.deleted_at = datetime.datetime.now()
 
+        self._invalidate_caches()
+
         return self
 
     @classmethod
-    def load_from_csv(cls, f_path, column_index, delimiter=',', header=True,
-            empty_check_col=1, repr_col=1, row_commit=False):
+    def _get_query_from_filters(cls, filters):
+        """
+        Returns the query of the objects matching the filters, given either as
+        a dictionary of keywords like `filter_by_keywords` or as a tuple of
+        expressions like `filter_by_expressions`. Returns None if the filters
+        are neither.
         """
-        This function takes a relative path of a csv file and populates
-        the database with the contents of the csv file.
 
-        :param str f_path: The relative path to the file
-        :param dict column_index: Model field_name, CSV index mapper
-        :param bool header: Flag to determine whether to skip first line of CSV
-        :param int empty_check_col: The column count if empty marks last line of CSV
-        :param int repr_col: The value to be printed for each row in log messages
-        :param bool row_commit: If True, commit immediately after adding to session
+        if isinstance(filters, dict):
+            return cls.query.filter_by(**filters)
 
-        :return bool: True
-        """
+        if isinstance(filters, tuple):
+            return cls.query.filter(*filters)
 
-        objects = []
-        duplicates = []
-        rows = get_rows_from_csv(f_path, delimiter=delimiter, header=header, empty_check_col=empty_check_col)
-        for row_index, row in enumerate(rows):
-            logger.debug('Loading {} `{}` from CSV..'.format(cls.__name__, row[repr_col]))
-            data = {}
-            for k, v in column_index.items():
-                if type(v) == dict:  # Handling nested dictionary
-                    data[k] = {}
-                    for sk, sv in v.items():  # sk: sub_key, sv: sub_value :P
-                        cls._add_key_from_csv_row(data[k], sk, sv, row)
-                else:
-                    cls._add_key_from_csv_row(data, k, v, row)
+        logger.error(
+            'The \'filters\' argument expects a dictionary or a tuple,'
+            ' but got a {} instead'.format(type(filters))
+        )
+        return None
 
-            # The following try-except block applies only for user
-            # Skip row if error occurs
-            try:
-                obj = cls(data, from_seed_file=True)
-            except InvalidRequestData as e:
-                if hasattr(e, 'duplicate') and e.duplicate:
-                    duplicates.append(e.duplicate.get_details())
-                e.row = row_index
-                continue
-            db.session.add(obj)
+    @classmethod
+    def _bulk_update_query(cls, q, data):
+        """
+        Runs a single UPDATE on the rows of the query, keeping the objects
+        already in the session in sync and invalidating the cached entries of
+        the updated rows.
+        """
 
-            if row_commit:
-                try:
-                    db.session.commit()
-                except Exception as e:
-                    print(e)
-                    db.session.rollback()
+        rows = []
+        if cls.details_cache is not None or cls.token_cache is not None:
+            rows = q.with_entities(cls.id_, cls.token).all()
+
+        count = q.update(data, synchronize_session='fetch')
+        cls._mark_written()
+
+        if cls.details_cache is not None:
+            _drop_cached_keys(db.session, cls.details_cache, [
+                cls._get_details_cache_key(id_, level)
+                for id_, _ in rows
+                for level in DETAILS_LEVELS
+            ])
+        if cls.token_cache is not None \
+                and ('token' in data or 'status' in data):
+            _drop_cached_keys(db.session, cls.token_cache, [
+                cls._get_token_cache_key(token)
+                for _, token in rows
+                if token is not None
+            ])
+
+        return count
 
-            objects.append(obj)
+    @classmethod
+    def bulk_update(cls, filters, data):
+        """
+        Updates all the objects matching the filters with a single UPDATE
+        statement, instead of loading and flushing them one by one. Like
+        `update`, all validations have to be taken care of beforehand and the
+        changes are not committed.
+
+        :param dict or tuple filters: Keywords like `filter_by_keywords`, or
+        expressions like `filter_by_expressions`
+        :param dict data: Attribute name, value mapper
+
+        :return int: Number of rows updated
+        """
+
+        q = cls._get_query_from_filters(filters)
+        if q is None or not data:
+            return 0
+
+        return cls._bulk_update_query(q, data)
+
+    @classmethod
+    def bulk_soft_delete(cls, filters):
+        """
+        Soft deletes all the `active` objects matching the filters with a
+        single UPDATE statement, setting the status to `deleted` and the
+        `deleted_at` to the current time. The changes are not committed.
+
+        :param dict or tuple filters: Keywords like `filter_by_keywords`, or
+        expressions like `filter_by_expressions`
+
+        :return int: Number of rows deleted
+        """
+
+        q = cls._get_query_from_filters(filters)
+        if q is None:
+            return 0
+
+        return cls._bulk_update_query(q.filter(cls.status == 'active'), {
+            'status': 'deleted',
+            'deleted_at': datetime.datetime.now(),
+        })
+
+    @classmethod
+    def _get_version_key(cls):
+        return 'version:{}'.format(cls.__tablename__)
+
+    @classmethod
+    def get_version_token(cls):
+        """
+        Returns the version token of the model, which changes whenever
+        objects of the model are written. None if the model has no
+        `version_store`.
+
+        :return str:
+        """
+
+        store = cls.version_store
+        if store is None:
+            return None
+
+        key = cls._get_version_key()
+        token = store.get(key)
+        if token is None:
+            # Expired or never set, any new value invalidates the old ones
+            token = cls._bump_version()
+
+        return token
+
+    @classmethod
+    def _bump_version(cls):
+        """
+        Changes the version token of the model.
+
+        :return str: The new token
+        """
+
+        if cls.version_store is None:
+            return None
+
+        token = os.urandom(8).hex()
+        cls.version_store.set(cls._get_version_key(), token)
+        return token
+
+    @classmethod
+    def add_write_listener(cls, listener):
+        """
+        Registers a function to be called after every commit of a transaction
+        that wrote objects of the model or of its subclasses, eg. to
+        invalidate a cache built from them. It is called with the model
+        written; listeners registered on `BaseModel` are called for all the
+        models.
+
+        :param function listener: The function
+        """
+
+        _write_listeners[cls].append(listener)
+
+    @classmethod
+    def _mark_written(cls):
+        """
+        Records that the current transaction writes objects of the model, for
+        the writes that don't go through the flush. The version is changed
+        when the transaction is committed.
+        """
+
+        _get_written_models(db.session).add(cls)
+
+    @classmethod
+    def _get_details_cache_key(cls, id_, level):
+        return '{}:{}:{}'.format(cls.__tablename__, id_, level)
+
+    def _invalidate_caches(self, deleted=False):
+        """
+        Removes the cached entries of the object. Called on `update`,
+        `soft_delete` and when the object is flushed with changes.
+
+        :param bool deleted: Set if the row itself is being deleted
+        """
+
+        # Read the id from the identity key, the attributes may be expired
+        state = inspect(self)
+        if state.identity is None:
+            return
+        id_ = state.identity[0]
+        session = state.session or db.session
+
+        if self.token_cache is not None:
+            token_history = state.attrs.token.history
+            if deleted or token_history.has_changes() \
+                    or state.attrs.status.history.has_changes():
+                _drop_cached_keys(session, self.token_cache, [
+                    self._get_token_cache_key(token)
+                    for token in token_history.sum()
+                    if token is not None
+                ])
+
+        if self.details_cache is not None:
+            _drop_cached_keys(session, self.details_cache, [
+                self._get_details_cache_key(id_, level)
+                for level in DETAILS_LEVELS
+            ])
+
+    def _has_uncommitted_changes(self):
+        """
+        Checks if the object has changes that are not committed yet, pending
+        in the session or already flushed, in which case its details must not
+        be cached.
+
+        :return bool:
+        """
+
+        state = inspect(self)
+        if state.session is None:
+            return False
+        if state.pending or state.modified:
+            return True
+
+        dropped = state.session.info.get('zephony_dropped_keys')
+        if not dropped or state.identity is None:
+            return False
+
+        key = self._get_details_cache_key(state.identity[0], DETAILS_LEVELS[0])
+        return any(key in keys for _, keys in dropped.values())
+
+    @classmethod
+    def _get_data_from_csv_row(cls, column_index, row, context=None):
+        """
+        Builds the data dictionary that is passed to the constructor from a
+        single CSV row, as described by the `column_index` of `load_from_csv`.
+        """
+
+        data = {}
+        for k, v in column_index.items():
+            if type(v) == dict:  # Handling nested dictionary
+                data[k] = {}
+                for sk, sv in v.items():  # sk: sub_key, sv: sub_value :P
+                    cls._add_key_from_csv_row(data[k], sk, sv, row, context)
+            else:
+                cls._add_key_from_csv_row(data, k, v, row, context)
+
+        return data
+
+    @classmethod
+    def _get_bulk_insert_mapping(cls, data):
+        """
+        Returns the column values of a row to be inserted by the bulk mode of
+        `load_from_csv`. The object is built with the constructor, exactly like
+        the regular mode, but never added to the session. Child classes can
+        override this to map `data` to the columns directly when the
+        constructor is too expensive.
+
+        Columns left empty are dropped from the mapping if the database
+        provides a default for them, Python side defaults are filled in.
+
+        :param dict data: The data built from the CSV row
+
+        :return dict: Column key, value mapper
+        """
+
+        obj = cls(data, from_seed_file=True)
+
+        # The object may have been cascaded into the session through a
+        # relationship to a persistent object
+        if obj in db.session:
+            db.session.expunge(obj)
+
+        mapping = {}
+        for attr in inspect(cls).column_attrs:
+            column = attr.columns[0]
+            if not isinstance(column, db.Column) or column.table is not cls.__table__:
+                continue
+
+            value = getattr(obj, attr.key)
+            if value is None:
+                default = column.default
+                if default is not None and default.is_scalar:
+                    value = default.arg
+                elif default is not None and default.is_callable:
+                    value = default.arg(None)
+                elif (column.server_default is not None or default is not None
+                        or column.autoincrement is True
+                        or (column.primary_key and column.autoincrement == 'auto')):
+                    continue
+
+            mapping[column.key] = value
+
+        return mapping
+
+    @classmethod
+    def _insert_mappings(cls, mappings, use_copy=False):
+        """
+        Inserts the rows with a single executemany, or with COPY if `use_copy`
+        is set and the database is PostgreSQL. Nothing is committed here.
+
+        :param list(dict) mappings: Rows returned by `_get_bulk_insert_mapping`
+        :param bool use_copy: Use COPY ... FROM STDIN on PostgreSQL
+        """
+
+        connection = db.session.connection(
+            bind_arguments={'mapper': inspect(cls)}
+        )
+        # `copy_expert` is specific to psycopg2
+        if use_copy and (connection.dialect.name != 'postgresql'
+                or connection.dialect.driver != 'psycopg2'):
+            logger.warning(
+                'COPY is only supported on PostgreSQL with psycopg2, using '
+                'executemany for `{}`'.format(cls.__name__)
+            )
+            use_copy = False
+
+        # Every row of an executemany has to have the same set of keys
+        groups = {}
+        for mapping in mappings:
+            groups.setdefault(tuple(mapping), []).append(mapping)
+
+        for keys, group in groups.items():
+            if not use_copy:
+                connection.execute(cls.__table__.insert(), group)
+                continue
+
+            # The values go through the bind processors of the column types
+            # as with executemany, eg. for JSON and Enum columns
+            processors = [
+                cls.__table__.c[k].type.bind_processor(connection.dialect)
+                for k in keys
+            ]
+            buffer = io.StringIO()
+            for mapping in group:
+                buffer.write(','.join(
+                    _format_copy_value(
+                        processor(mapping[k]) if processor is not None
+                        else mapping[k]
+                    )
+                    for k, processor in zip(keys, processors)
+                ))
+                buffer.write('\n')
+            buffer.seek(0)
+
+            preparer = connection.dialect.identifier_preparer
+            statement = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                preparer.format_table(cls.__table__),
+                ', '.join(preparer.quote(cls.__table__.c[k].name) for k in keys),
+            )
+            cursor = connection.connection.cursor()
+            try:
+                cursor.copy_expert(statement, buffer)
+            finally:
+                cursor.close()
+
+    @classmethod
+    def _get_upsert_insert(cls):
+        """
+        Returns the `insert` construct supporting `ON CONFLICT` of the
+        database of the model.
+
+        :raise NotImplementedError: If the database is not PostgreSQL or
+            SQLite
+        """
+
+        dialect = db.session.get_bind(mapper=inspect(cls)).dialect
+        if dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise NotImplementedError(
+                'Upsert is not supported on {}'.format(dialect.name)
+            )
+
+        return insert
+
+    @classmethod
+    def _get_duplicate_upsert_mapping(cls, data, duplicate):
+        """
+        Returns the column values of a row the constructor rejected as a
+        duplicate of an existing object, for the upsert mode to update that
+        object: its current values, overridden by the ones of the row. The
+        values of the row are taken as they are, without the changes the
+        constructor would make.
+
+        :param dict data: The data built from the CSV row
+        :param BaseModel duplicate: The existing object
+
+        :return dict: Column key, value mapper
+        """
+
+        mapping = {}
+        for attr in inspect(cls).column_attrs:
+            column = attr.columns[0]
+            if not isinstance(column, db.Column) or column.table is not cls.__table__ \
+                    or column.primary_key:
+                continue
+
+            if attr.key in data and not isinstance(data[attr.key], dict):
+                mapping[column.key] = data[attr.key]
+            else:
+                mapping[column.key] = getattr(duplicate, attr.key)
+
+        return mapping
+
+    @classmethod
+    def _upsert_mappings(cls, mappings, upsert_key):
+        """
+        Inserts the rows, or updates the existing rows having the same natural
+        key, with `INSERT ... ON CONFLICT DO UPDATE` (PostgreSQL and SQLite).
+        The existing rows are fetched first with one query to tell the new,
+        changed and unchanged rows apart, and only the first two are sent.
+        The values are compared after being converted to the types of their
+        columns, the CSV cells being strings. Nothing is committed here.
+
+        The primary key and the token (unless it is the key) are never
+        updated. The key columns need a unique constraint.
+
+        :param list(dict) mappings: Rows returned by `_get_bulk_insert_mapping`
+        :param str or tuple upsert_key: The natural key column(s)
+
+        :return tuple: Inserted, updated and unchanged counts
+        """
+
+        connection = db.session.connection(
+            bind_arguments={'mapper': inspect(cls)}
+        )
+        insert = cls._get_upsert_insert()
+
+        table = cls.__table__
+        key = (upsert_key,) if isinstance(upsert_key, str) else tuple(upsert_key)
+        excluded = set(key) | {'token'} | {c.key for c in table.primary_key}
+
+        # A statement cannot update the same row twice, the last row of the
+        # batch with a given key wins and is counted once
+        rows_by_key = {}
+        for mapping in mappings:
+            try:
+                row_key = tuple(
+                    _coerce_to_column_type(table.c[k], mapping[k]) for k in key
+                )
+            except KeyError as e:
+                raise ValueError('Upsert key {} missing from the row'.format(e))
+            rows_by_key[row_key] = mapping
+
+        key_columns = [table.c[k] for k in key]
+        compared_keys = sorted(set().union(*rows_by_key.values()) - excluded)
+        if len(key_columns) == 1:
+            condition = key_columns[0].in_([k[0] for k in rows_by_key])
+        else:
+            condition = tuple_(*key_columns).in_(list(rows_by_key))
+
+        existing = {}
+        q = select(*key_columns, *[table.c[k] for k in compared_keys]).where(condition)
+        for row in connection.execute(q):
+            existing[tuple(row[:len(key)])] = dict(zip(compared_keys, row[len(key):]))
+
+        inserted = 0
+        updated = 0
+        unchanged = 0
+        to_write = []
+        for row_key, mapping in rows_by_key.items():
+            current = existing.get(row_key)
+            if current is None:
+                inserted += 1
+            elif any(
+                current[k] != _coerce_to_column_type(table.c[k], v)
+                for k, v in mapping.items() if k not in excluded
+            ):
+                updated += 1
+            else:
+                unchanged += 1
+                continue
+            to_write.append(mapping)
+
+        groups = {}
+        for mapping in to_write:
+            groups.setdefault(tuple(mapping), []).append(mapping)
+
+        for keys, group in groups.items():
+            statement = insert(table)
+            update_keys = [k for k in keys if k not in excluded]
+            if update_keys:
+                statement = statement.on_conflict_do_update(
+                    index_elements=key_columns,
+                    set_={k: statement.excluded[k] for k in update_keys},
+                )
+            else:
+                statement = statement.on_conflict_do_nothing(
+                    index_elements=key_columns,
+                )
+            connection.execute(statement, group)
+
+        return inserted, updated, unchanged
+
+    @classmethod
+    def _bulk_load_items(cls, items, column_index, batch_size=1000,
+            use_copy=False, repr_col=1, context=None, upsert_key=None,
+            checkpoint=None):
+        """
+        The bulk mode of `load_from_csv`. Rows are sent to the database in
+        batches of `batch_size` and committed once per batch. A batch that
+        fails is rolled back and reported, the remaining batches still go
+        through.
+
+        The items are (row index, row, data, byte offset) tuples, the data
+        built so far from the row being completed with the `column_index`.
+        The offset, the end of the row in the file, is only needed to save
+        the progress in the `checkpoint` after each committed batch.
+
+        :return dict: Inserted (updated, unchanged) counts, failed batches
+            and duplicates, if any
+        """
+
+        if context is None:
+            context = CsvImportContext()
+
+        # Fail once rather than in every batch
+        if upsert_key:
+            cls._get_upsert_insert()
+
+        inserted = 0
+        updated = 0
+        unchanged = 0
+        duplicates = []
+        failed_batches = []
+        first_batch = checkpoint.batch + 1 if checkpoint is not None else 0
+        batches = get_chunks(items, batch_size)
+        for batch_index, batch in enumerate(batches, start=first_batch):
+            context.prefetch_foreign_keys(column_index, [item[1] for item in batch])
+
+            mappings = []
+            for row_index, row, data, _ in batch:
+                logger.debug('Loading {} `{}` from CSV..'.format(cls.__name__, row[repr_col]))
+                data = _merge_data(
+                    data,
+                    cls._get_data_from_csv_row(column_index, row, context),
+                )
+
+                # Skip row if the constructor rejects it, same as the
+                # regular mode. The upsert mode updates the duplicates.
+                try:
+                    mappings.append(cls._get_bulk_insert_mapping(data))
+                except InvalidRequestData as e:
+                    duplicate = getattr(e, 'duplicate', None)
+                    if upsert_key and isinstance(duplicate, cls):
+                        mappings.append(
+                            cls._get_duplicate_upsert_mapping(data, duplicate)
+                        )
+                        continue
+                    if duplicate:
+                        duplicates.append(duplicate.get_details())
+                    e.row = row_index
+                    continue
+
+            if not mappings:
+                if checkpoint is not None:
+                    checkpoint.save(batch[-1][3], batch_index, batch[-1][0] + 1)
+                continue
+
+            try:
+                if upsert_key:
+                    counts = cls._upsert_mappings(mappings, upsert_key)
+                else:
+                    cls._insert_mappings(mappings, use_copy=use_copy)
+                    counts = (len(mappings), 0, 0)
+                cls._mark_written()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error('{}: Batch {} (rows {} to {}) failed: {}'.format(
+                    cls.__name__, batch_index, batch[0][0], batch[-1][0], e
+                ))
+                failed_batches.append({
+                    'batch': batch_index,
+                    'first_row': batch[0][0],
+                    'last_row': batch[-1][0],
+                    'rows_count': len(mappings),
+                    'error': str(e),
+                })
+                continue
+
+            inserted += counts[0]
+            updated += counts[1]
+            unchanged += counts[2]
+
+            if checkpoint is not None:
+                checkpoint.save(batch[-1][3], batch_index, batch[-1][0] + 1)
+
+        res = {
+            'inserted_count': inserted,
+            'failed_batches': failed_batches,
+        }
+
+        if upsert_key:
+            res['updated_count'] = updated
+            res['unchanged_count'] = unchanged
+
+        if duplicates:
+            res['duplicates'] = duplicates
+
+        return res
+
+    @classmethod
+    def _parallel_load_csv(cls, f_path, column_index, processes,
+            delimiter=',', header=True, empty_check_col=1, batch_size=1000,
+            use_copy=False, repr_col=1, context=None, upsert_key=None,
+            checkpoint=None):
+        """
+        The parallel mode of `load_from_csv`. The columns that don't need the
+        database are casted in the worker processes, the `foreign_key` and
+        `permission_tokens` ones are resolved here, batch by batch.
+
+        The chunks are at most `_MAX_CHUNK_SIZE` bytes, and only a few of them
+        are parsed ahead of the writes, so the memory used doesn't depend on
+        the size of the file.
+        """
+
+        start = checkpoint.offset if checkpoint is not None else 0
+        first_row = checkpoint.rows_count if checkpoint is not None else 0
+
+        local_index, database_index = _split_column_index(column_index)
+        ranges = get_csv_byte_ranges(
+            f_path,
+            max(
+                processes * _CHUNKS_PER_PROCESS,
+                math.ceil((os.path.getsize(f_path) - start) / _MAX_CHUNK_SIZE),
+            ),
+            start=start,
+        )
+
+        errors = []
+        rows_count = [first_row]
+
+        def get_items(results):
+            # The chunks come back in the order of the file
+            for chunk in results:
+                for row, data, error, offset in chunk:
+                    row_index = rows_count[0]
+                    rows_count[0] += 1
+                    if error is not None:
+                        errors.append({'row': row_index, 'error': error})
+                        continue
+                    yield row_index, row, data, offset
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = _map_in_order(
+                executor,
+                _transform_csv_range,
+                (
+                    (
+                        cls,
+                        f_path,
+                        start,
+                        end,
+                        local_index,
+                        header,
+                        delimiter,
+                        empty_check_col,
+                    )
+                    for start, end in ranges
+                ),
+                processes * _PENDING_CHUNKS_PER_PROCESS,
+            )
+            res = cls._bulk_load_items(
+                get_items(results),
+                database_index,
+                batch_size=batch_size,
+                use_copy=use_copy,
+                repr_col=repr_col,
+                context=context,
+                upsert_key=upsert_key,
+                checkpoint=checkpoint,
+            )
+
+        res['total_non_empty_rows'] = rows_count[0]
+        if errors:
+            res['errors'] = errors
+
+        return res
+
+    @classmethod
+    def load_from_csv(cls, f_path, column_index, delimiter=',', header=True,
+            empty_check_col=1, repr_col=1, row_commit=False, bulk=False,
+            batch_size=1000, use_copy=False, context=None, upsert_key=None,
+            processes=None, checkpoint_path=None, typed=False, use_numpy=False):
+        """
+        This function takes a relative path of a csv file and populates
+        the database with the contents of the csv file.
+
+        In the bulk mode, the rows are not added to the session as objects
+        but inserted in batches with a Core executemany (or COPY on
+        PostgreSQL when `use_copy` is set), with one commit per batch. The
+        result then has `inserted_count` and `failed_batches` instead of
+        `objects`.
+
+        The upsert mode (`upsert_key` set) makes re-running an import on an
+        updated file idempotent. It works like the bulk mode, but the rows
+        whose natural key (`token`, or a tuple of columns) already exists are
+        updated instead, with set-based `INSERT ... ON CONFLICT DO UPDATE`.
+        The result also has `updated_count` and `unchanged_count`. The rows
+        are still built with the constructor; the ones it rejects as
+        duplicates (`InvalidRequestData` with a `duplicate`) update the
+        duplicate object.
+
+        The parallel mode (`processes` set) is a bulk or upsert import in
+        which the file is split into chunks on line boundaries, and the
+        chunks are parsed and type casted in a pool of processes. The rows
+        are then written from this process in batches, in the order of the
+        file. Rows that cannot be casted are skipped and listed in `errors`
+        with their index. Quoted values spanning multiple lines are not
+        supported in this mode.
+
+        The bulk, upsert and parallel modes can be resumed: with
+        `checkpoint_path`, the progress (file checksum, byte offset and last
+        committed batch) is saved to that file after every batch. If the
+        import dies, running it again on the same file starts right after the
+        last committed batch, and `resumed_from_row` is added to the result.
+        The checkpoint is removed once the import completes.
+
+        With `typed`, the file is read with the columnar reader
+        `iter_columns_from_csv`, the integer, date, boolean and permission bit
+        columns of `column_index` being converted a batch at a time rather
+        than cell by cell. It is not supported with `processes` and
+        `checkpoint_path`.
+
+        In all the modes, the `foreign_key` and `permission_tokens` columns
+        are resolved through a `CsvImportContext`, which looks the names up
+        once per batch of rows. Pass a context to share it across imports.
+
+        :param str f_path: The relative path to the file
+        :param dict column_index: Model field_name, CSV index mapper
+        :param bool header: Flag to determine whether to skip first line of CSV
+        :param int empty_check_col: The column count if empty marks last line of CSV
+        :param int repr_col: The value to be printed for each row in log messages
+        :param bool row_commit: If True, commit immediately after adding to session
+        :param bool bulk: Insert the rows in batches, bypassing the session
+        :param int batch_size: Rows per batch in the bulk mode
+        :param bool use_copy: Use COPY instead of executemany on PostgreSQL
+        :param CsvImportContext context: Lookups shared across the import
+        :param str or tuple upsert_key: Natural key column(s) to upsert on
+        :param int processes: Number of processes to parse the file with
+        :param str checkpoint_path: File to save the progress of the import to
+        :param bool typed: Convert the columns with the typed columnar reader
+        :param bool use_numpy: Use NumPy arrays in the typed reader
+
+        :return dict:
+        """
+
+        if context is None:
+            context = CsvImportContext()
+
+        if typed and (processes or checkpoint_path):
+            raise ValueError(
+                'The typed reader is not supported in the parallel and '
+                'resumable modes'
+            )
+
+        checkpoint = None
+        if checkpoint_path:
+            if not (bulk or upsert_key or processes):
+                raise ValueError(
+                    'Checkpoints need the bulk, upsert or parallel mode'
+                )
+            checkpoint = CsvImportCheckpoint(checkpoint_path, f_path)
+
+        if checkpoint is not None:
+            if processes:
+                res = cls._parallel_load_csv(
+                    f_path,
+                    column_index,
+                    processes,
+                    delimiter=delimiter,
+                    header=header,
+                    empty_check_col=empty_check_col,
+                    batch_size=batch_size,
+                    use_copy=use_copy,
+                    repr_col=repr_col,
+                    context=context,
+                    upsert_key=upsert_key,
+                    checkpoint=checkpoint,
+                )
+            else:
+                rows = iter_rows_from_csv_range(
+                    f_path,
+                    start=checkpoint.offset,
+                    header=header,
+                    delimiter=delimiter,
+                    empty_check_col=empty_check_col,
+                )
+                rows_count = [checkpoint.rows_count]
+
+                def get_items():
+                    for row, offset in rows:
+                        yield rows_count[0], row, {}, offset
+                        rows_count[0] += 1
+
+                res = cls._bulk_load_items(
+                    get_items(),
+                    column_index,
+                    batch_size=batch_size,
+                    use_copy=use_copy,
+                    repr_col=repr_col,
+                    context=context,
+                    upsert_key=upsert_key,
+                    checkpoint=checkpoint,
+                )
+                res['total_non_empty_rows'] = rows_count[0]
+
+            if checkpoint.resumed:
+                res['resumed_from_row'] = checkpoint.resumed_from_row
+            checkpoint.clear()
+            return res
+
+        if processes:
+            return cls._parallel_load_csv(
+                f_path,
+                column_index,
+                processes,
+                delimiter=delimiter,
+                header=header,
+                empty_check_col=empty_check_col,
+                batch_size=batch_size,
+                use_copy=use_copy,
+                repr_col=repr_col,
+                context=context,
+                upsert_key=upsert_key,
+            )
+
+        # The rows are streamed from the file as they are loaded
+        if typed:
+            rows = (
+                row
+                for columns in iter_columns_from_csv(
+                    f_path,
+                    _get_csv_schema(column_index),
+                    header=header,
+                    delimiter=delimiter,
+                    empty_check_col=empty_check_col,
+                    batch_size=batch_size,
+                    use_numpy=use_numpy,
+                )
+                for row in columns.iter_rows()
+            )
+        else:
+            rows = iter_rows_from_csv(f_path, delimiter=delimiter, header=header, empty_check_col=empty_check_col)
+
+        return cls.load_from_rows(
+            rows,
+            column_index,
+            repr_col=repr_col,
+            row_commit=row_commit,
+            bulk=bulk,
+            batch_size=batch_size,
+            use_copy=use_copy,
+            context=context,
+            upsert_key=upsert_key,
+        )
+
+    @classmethod
+    def load_from_rows(cls, rows, column_index, repr_col=1, row_commit=False,
+            bulk=False, batch_size=1000, use_copy=False, context=None,
+            upsert_key=None):
+        """
+        Populates the database with rows already read from a file, eg. the
+        rows of a workbook sheet. The rows are loaded as they are iterated,
+        like in `load_from_csv`, which has the details of the modes.
+
+        :param iterable rows: The rows, lists or tuples of strings
+        :param dict column_index: Model field_name, row index mapper
+        :param int repr_col: The value to be printed for each row in log messages
+        :param bool row_commit: If True, commit immediately after adding to session
+        :param bool bulk: Insert the rows in batches, bypassing the session
+        :param int batch_size: Rows per batch in the bulk mode
+        :param bool use_copy: Use COPY instead of executemany on PostgreSQL
+        :param CsvImportContext context: Lookups shared across the import
+        :param str or tuple upsert_key: Natural key column(s) to upsert on
+
+        :return dict:
+        """
+
+        if context is None:
+            context = CsvImportContext()
+
+        rows_count = [0]
+
+        def get_rows():
+            for row in rows:
+                rows_count[0] += 1
+                yield row
+
+        if bulk or upsert_key:
+            res = cls._bulk_load_items(
+                ((row_index, row, {}, None) for row_index, row in enumerate(get_rows())),
+                column_index,
+                batch_size=batch_size,
+                use_copy=use_copy,
+                repr_col=repr_col,
+                context=context,
+                upsert_key=upsert_key,
+            )
+            res['total_non_empty_rows'] = rows_count[0]
+            return res
+
+        objects = []
+        duplicates = []
+        for batch in get_chunks(enumerate(get_rows()), batch_size):
+            context.prefetch_foreign_keys(column_index, [row for _, row in batch])
+
+            for row_index, row in batch:
+                logger.debug('Loading {} `{}` from CSV..'.format(cls.__name__, row[repr_col]))
+                data = cls._get_data_from_csv_row(column_index, row, context)
+
+                # The following try-except block applies only for user
+                # Skip row if error occurs
+                try:
+                    obj = cls(data, from_seed_file=True)
+                except InvalidRequestData as e:
+                    if hasattr(e, 'duplicate') and e.duplicate:
+                        duplicates.append(e.duplicate.get_details())
+                    e.row = row_index
+                    continue
+                db.session.add(obj)
+
+                if row_commit:
+                    try:
+                        db.session.commit()
+                    except Exception as e:
+                        print(e)
+                        db.session.rollback()
+
+                objects.append(obj)
 
         res = {
             'objects': objects,
-            'total_non_empty_rows': len(rows),
+            'total_non_empty_rows': rows_count[0],
         }
 
         if duplicates:
@@ -796,3 +2244,858 @@ class BaseModel(db.Model):
 
         return res
 
+
+# Levels of `BaseModel.get_details`, from lower to higher
+DETAILS_LEVELS = (
+    'INFO',
+    'BASIC',
+    'FULL',
+    'EXTRA',
+)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_flushed_objects(session, flush_context):
+    """
+    Invalidates the cached entries of the objects that were changed or deleted
+    by the flush, and records the models written for their version tokens.
+    """
+
+    written_models = _get_written_models(session)
+    for obj in session.new:
+        if isinstance(obj, BaseModel):
+            written_models.add(type(obj))
+
+    for obj in session.deleted:
+        if isinstance(obj, BaseModel):
+            obj._invalidate_caches(deleted=True)
+            written_models.add(type(obj))
+
+    for obj in session.dirty:
+        if isinstance(obj, BaseModel) and session.is_modified(obj):
+            obj._invalidate_caches()
+            written_models.add(type(obj))
+
+
+def _get_written_models(session):
+    """
+    Returns the set of the models written in the current transaction of the
+    session.
+    """
+
+    return session.info.setdefault('zephony_written_models', set())
+
+
+# Model -> functions called after the commits writing its objects
+_write_listeners = collections.defaultdict(list)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_written_versions(session):
+    """
+    Changes the version tokens of the models written by the transaction and
+    calls their write listeners, once the writes are visible to the other
+    connections.
+    """
+
+    for cls in session.info.pop('zephony_written_models', ()):
+        cls._bump_version()
+
+        for base in cls.__mro__:
+            for listener in _write_listeners.get(base, ()):
+                try:
+                    listener(cls)
+                except Exception:
+                    # The transaction is already committed
+                    logger.exception('Write listener of {} failed'.format(
+                        cls.__name__
+                    ))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_written_models(session):
+    session.info.pop('zephony_written_models', None)
+
+
+def _drop_cached_keys(session, cache, keys):
+    """
+    Deletes the keys from the cache now, and again once the transaction of
+    the session ends, so that neither the values cached by other requests
+    until the commit nor values cached before a rollback remain.
+    """
+
+    if not keys:
+        return
+
+    cache.delete_many(keys)
+    dropped = session.info.setdefault('zephony_dropped_keys', {})
+    dropped.setdefault(id(cache), (cache, set()))[1].update(keys)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _delete_dropped_keys(session):
+    for cache, keys in session.info.pop('zephony_dropped_keys', {}).values():
+        cache.delete_many(list(keys))
+
+
+def _is_cursor_value_valid(attribute, value):
+    """
+    Checks that the sort value of a cursor has a type the column can be
+    compared with.
+    """
+
+    if isinstance(value, bool):
+        return attribute.type.python_type is bool
+
+    try:
+        python_type = attribute.type.python_type
+    except NotImplementedError:
+        return isinstance(value, (str, int, float, decimal.Decimal,
+            datetime.date))
+
+    if python_type in (int, float, decimal.Decimal):
+        if python_type is int:
+            return isinstance(value, int)
+        return isinstance(value, (int, float, decimal.Decimal))
+    if python_type is datetime.date:
+        return isinstance(value, datetime.date) \
+            and not isinstance(value, datetime.datetime)
+
+    return isinstance(value, python_type)
+
+
+_RELATIONSHIP_LOADERS = {
+    'selectin': selectinload,
+    'joined': joinedload,
+    'subquery': subqueryload,
+    'default': defaultload,
+}
+
+
+@contextlib.contextmanager
+def _lazy_load_check(mode):
+    """
+    Warns, or raises a RuntimeError if `mode` is 'raise', when an attribute
+    of an object is loaded lazily within the block.
+    """
+
+    if not mode:
+        yield
+        return
+
+    def on_execute(orm_execute_state):
+        if orm_execute_state.lazy_loaded_from is not None:
+            message = 'Lazy load of a relationship of {}'.format(
+                orm_execute_state.lazy_loaded_from.class_.__name__
+            )
+        elif orm_execute_state.is_column_load:
+            message = 'Lazy load of the columns of {}'.format(
+                orm_execute_state.bind_mapper.class_.__name__
+            )
+        else:
+            return
+
+        if mode == 'raise':
+            raise RuntimeError(message)
+        logger.warning('{}: {}'.format(message, orm_execute_state.statement))
+
+    session = db.session()
+    event.listen(session, 'do_orm_execute', on_execute)
+    try:
+        yield
+    finally:
+        event.remove(session, 'do_orm_execute', on_execute)
+
+
+# Filter operators by field type. Each factory gets the column expression of
+# a field and returns a function that builds the filter from the values, the
+# values being OR-ed.
+def _text_starts_with(attribute):
+    return lambda values: or_(*[attribute.ilike(v+'%') for v in values])
+
+
+def _text_ends_with(attribute):
+    return lambda values: or_(*[attribute.ilike('%'+v) for v in values])
+
+
+def _text_contains(attribute):
+    return lambda values: or_(*[attribute.ilike('%'+v+'%') for v in values])
+
+
+def _text_equals(attribute):
+    lowered = func.lower(attribute)
+    return lambda values: or_(*[lowered == v.lower() for v in values])
+
+
+def _lesser_than(attribute):
+    return lambda values: or_(*[attribute < v for v in values])
+
+
+def _greater_than(attribute):
+    return lambda values: or_(*[attribute > v for v in values])
+
+
+def _equals(attribute):
+    return lambda values: or_(*[attribute == v for v in values])
+
+
+def _get_in_expression(expression, values):
+    """
+    Returns `expression IN values` with the values bound as a single
+    parameter, `= ANY(:array)` on PostgreSQL, so the statement stays the same
+    whatever the number of values.
+    """
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        type_ = expression.type
+        if isinstance(type_, NullType):
+            type_ = db.String()
+        return expression == any_(bindparam(None, values, type_=ARRAY(type_)))
+
+    return expression.in_(bindparam(None, values, expanding=True))
+
+
+def _text_in(attribute):
+    lowered = func.lower(attribute)
+    return lambda values: _get_in_expression(
+        lowered,
+        [v.lower() for v in values],
+    )
+
+
+def _int_in(attribute):
+    def get_expression(values):
+        int_values = []
+        for v in values:
+            try:
+                int_values.append(int(v))
+            except (TypeError, ValueError):
+                logger.warn('Invalid integer {}. Ignoring.'.format(v))
+
+        return _get_in_expression(attribute, int_values)
+
+    return get_expression
+
+
+def _in(attribute):
+    return lambda values: _get_in_expression(attribute, list(values))
+
+
+def _date_from(attribute):
+    date = func.date(attribute)
+    return lambda values: or_(*[date >= v for v in values])
+
+
+def _date_to(attribute):
+    date = func.date(attribute)
+    return lambda values: or_(*[date <= v for v in values])
+
+
+_FILTER_OPERATORS = {
+    'TEXT': {
+        'starts_with': _text_starts_with,
+        'ends_with': _text_ends_with,
+        'contains': _text_contains,
+        'equals': _text_equals,
+        'in': _text_in,
+    },
+    'INT': {
+        'lesser_than': _lesser_than,
+        'greater_than': _greater_than,
+        'equals': _equals,
+        'in': _int_in,
+    },
+    'BOOL': {
+        'equals': _equals,
+        'in': _in,
+    },
+    'ENUM': {
+        'equals': _equals,
+        'in': _in,
+    },
+    'DATE': {
+        'from': _date_from,
+        'to': _date_to,
+        'equals': _equals,
+    },
+}
+
+# Compiled filter plans, see `BaseModel._get_filter_plan`
+_FILTER_PLANS_MAX_SIZE = 256
+_filter_plans = collections.OrderedDict()
+
+
+class CsvImportContext():
+    """
+    Holds the lookups shared by all the rows of a CSV import, so that the
+    `foreign_key` and `permission_tokens` columns don't hit the database for
+    every cell.
+
+    The referenced names are loaded with one `IN` query per related class for
+    each batch of rows, and the missing parents are inserted together. The
+    permissions map is fetched once for the whole run.
+    """
+
+    def __init__(self):
+        # {related class: {original_name: id}}
+        self.foreign_keys = {}
+        self._permissions_map = None
+
+    def get_permissions_map(self):
+        if self._permissions_map is None:
+            from .permission import Permission
+            self._permissions_map = Permission.get_map()
+
+        return self._permissions_map
+
+    @staticmethod
+    def _get_foreign_key_columns(column_index):
+        """
+        Returns the (CSV index, related class) pairs of all the `foreign_key`
+        columns in the column index, including the nested ones.
+        """
+
+        columns = []
+        for v in column_index.values():
+            values = v.values() if type(v) == dict else (v,)
+            for sv in values:
+                if type(sv) == tuple and len(sv) == 3 and sv[2] == 'foreign_key':
+                    columns.append((sv[0], sv[1]))
+
+        return columns
+
+    def prefetch_foreign_keys(self, column_index, rows):
+        """
+        Resolves the ids of all the related objects referenced by the rows,
+        creating the ones that do not exist yet.
+
+        :param dict column_index: The column index of `load_from_csv`
+        :param list rows: The CSV rows about to be loaded
+        """
+
+        names_by_class = {}
+        for col, related in self._get_foreign_key_columns(column_index):
+            ids = self.foreign_keys.setdefault(related, {})
+            names = names_by_class.setdefault(related, {})
+            for row in rows:
+                if row[col] not in ids:
+                    names[row[col]] = None
+
+        for related, names in names_by_class.items():
+            if names:
+                self._load_foreign_keys(related, list(names))
+
+    def _load_foreign_keys(self, related, names):
+        ids = self.foreign_keys[related]
+
+        results = related.query.with_entities(
+            related.original_name,
+            related.id_,
+        ).filter(
+            related.original_name.in_(names),
+            related.status == 'active',
+        ).order_by(related.id_)
+        for original_name, id_ in results:
+            ids.setdefault(original_name, id_)
+
+        missing = [name for name in names if name not in ids]
+        if not missing:
+            return
+
+        objects = [related({'original_name': name}) for name in missing]
+        db.session.add_all(objects)
+        db.session.flush()
+
+        # Read the ids before the commit expires the objects
+        for name, obj in zip(missing, objects):
+            ids[name] = obj.id_
+        db.session.commit()
+
+    def get_foreign_key_id(self, related, original_name):
+        """
+        Returns the id of the related object with the given name. Names that
+        were not prefetched are resolved on the spot.
+        """
+
+        ids = self.foreign_keys.setdefault(related, {})
+        if original_name not in ids:
+            self._load_foreign_keys(related, [original_name])
+
+        return ids[original_name]
+
+
+class CsvImportCheckpoint():
+    """
+    The progress of a bulk CSV import, saved as a small JSON file after each
+    committed batch: the checksum of the CSV file, the byte offset right
+    after the last committed row, the index of that batch and the number of
+    rows read so far. A checkpoint of a different file, or of an older
+    version of the file, is ignored.
+    """
+
+    def __init__(self, path, f_path):
+        """
+        :param str path: The path of the checkpoint file
+        :param str f_path: The path of the CSV file being imported
+        """
+
+        self.path = path
+        self.checksum = generate_checksum_of_file(f_path)
+        self.offset = 0
+        self.batch = -1
+        self.rows_count = 0
+        self.resumed = False
+
+        record = None
+        if os.path.exists(path):
+            with open(path) as f:
+                record = json.load(f)
+
+        if record and record.get('checksum') == self.checksum:
+            self.offset = record['offset']
+            self.batch = record['batch']
+            self.rows_count = record['rows_count']
+            self.resumed = True
+            logger.info('Resuming the import of `{}` from row {}'.format(
+                f_path,
+                self.rows_count,
+            ))
+        elif record:
+            logger.warning(
+                '`{}` does not match the checkpoint, starting over'.format(f_path)
+            )
+
+        self.resumed_from_row = self.rows_count
+
+    def save(self, offset, batch, rows_count):
+        self.offset = offset
+        self.batch = batch
+        self.rows_count = rows_count
+
+        # Write to a temporary file first so that a crash never leaves a
+        # partially written checkpoint
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'checksum': self.checksum,
+                'offset': self.offset,
+                'batch': self.batch,
+                'rows_count': self.rows_count,
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _merge_data(data, extra):
+    """
+    Merges the data built from two parts of a column index, nested
+    dictionaries included.
+    """
+
+    if not data:
+        return extra
+
+    for k, v in extra.items():
+        if type(v) == dict:
+            data.setdefault(k, {}).update(v)
+        else:
+            data[k] = v
+
+    return data
+
+
+def _needs_database(v):
+    return type(v) == tuple and len(v) == 3 \
+        and v[2] in ('foreign_key', 'permission_tokens')
+
+
+def _split_column_index(column_index):
+    """
+    Splits a column index of `load_from_csv` into the columns that can be
+    casted on their own and the ones that need to query the database.
+
+    :return tuple(dict): Local column index, database column index
+    """
+
+    local_index = {}
+    database_index = {}
+    for k, v in column_index.items():
+        if type(v) == dict:
+            for sk, sv in v.items():
+                target = database_index if _needs_database(sv) else local_index
+                target.setdefault(k, {})[sk] = sv
+        elif _needs_database(v):
+            database_index[k] = v
+        else:
+            local_index[k] = v
+
+    return local_index, database_index
+
+
+def _get_csv_schema(column_index):
+    """
+    Derives the column types of `iter_columns_from_csv` from a column index
+    of `load_from_csv`. Columns used with different types are left as
+    strings.
+
+    :return dict: CSV column index -> type
+    """
+
+    schema = {}
+    conflicts = set()
+
+    def add(v):
+        if type(v) == dict:
+            for sv in v.values():
+                add(sv)
+            return
+        if type(v) != tuple or len(v) == 1:
+            return
+
+        type_ = None
+        if len(v) == 2:
+            if v[1] is int:
+                type_ = 'int'
+            elif v[1] in ('datetime', 'datetime_iso'):
+                type_ = 'date'
+        elif v[2] == 'power_of_2' and v[1] is int:
+            type_ = 'power_of_2'
+        elif v[2] == 'boolean':
+            type_ = 'bool'
+
+        if type_ is None:
+            # Column also used as a string
+            conflicts.add(v[0])
+        elif schema.setdefault(v[0], type_) != type_:
+            conflicts.add(v[0])
+
+    for v in column_index.values():
+        add(v)
+
+    # Plain columns are strings too
+    for v in column_index.values():
+        if type(v) == int:
+            conflicts.add(v)
+
+    return {
+        i: type_ for i, type_ in schema.items() if i not in conflicts
+    }
+
+
+# Chunks the file is split into per process in the parallel import, more than
+# one so that the processes stay busy when chunks take unequal times
+_CHUNKS_PER_PROCESS = 4
+
+# Maximum size of the chunks of the parallel import, in bytes, and chunks
+# parsed ahead of the writes per process, which bound the memory it uses
+_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+_PENDING_CHUNKS_PER_PROCESS = 2
+
+
+def _map_in_order(executor, fn, args_list, max_pending):
+    """
+    Like `executor.map`, but only submitting the next arguments as the
+    results are consumed, with at most `max_pending` of them in flight.
+    """
+
+    pending = collections.deque()
+    for args in args_list:
+        pending.append(executor.submit(fn, args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _transform_csv_range(args):
+    """
+    Worker of the parallel CSV import. Parses a byte range of the file and
+    builds the data of each row from the columns that don't need the
+    database.
+
+    :return list(tuple): (row, data, error, byte offset) of each non empty
+        row
+    """
+
+    (cls, f_path, start, end, column_index, header, delimiter,
+        empty_check_col) = args
+
+    results = []
+    for row, offset in iter_rows_from_csv_range(f_path, start=start, end=end,
+            header=header, delimiter=delimiter, empty_check_col=empty_check_col):
+        try:
+            data = cls._get_data_from_csv_row(column_index, row)
+            results.append((row, data, None, offset))
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+            results.append((row, None, error, offset))
+
+    return results
+
+
+def _coerce_to_column_type(column, value):
+    """
+    Converts a value, usually a string read from a CSV file, to the Python
+    type the column returns, for it to be compared with the values read from
+    the database. Values that cannot be converted are returned as they are.
+    """
+
+    if value is None:
+        return None
+
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+
+    if isinstance(value, python_type) \
+            and not (python_type is int and isinstance(value, bool)):
+        return value
+    if not isinstance(value, str):
+        # Eg. an int for a Numeric column
+        try:
+            return python_type(value)
+        except (TypeError, ValueError, decimal.InvalidOperation):
+            return value
+
+    try:
+        if python_type is bool:
+            return value.strip().lower() in ('true', 't', '1', 'yes', 'x')
+        if python_type is datetime.datetime:
+            return datetime.datetime.fromisoformat(value)
+        if python_type is datetime.date:
+            return datetime.datetime.fromisoformat(value).date()
+        if python_type is datetime.time:
+            return datetime.time.fromisoformat(value)
+        if python_type in (int, float, decimal.Decimal):
+            return python_type(value)
+    except (ValueError, decimal.InvalidOperation):
+        pass
+
+    return value
+
+
+def _format_copy_value(value):
+    """
+    Formats a value as a field of PostgreSQL's CSV COPY format, in which only
+    an unquoted empty field is NULL.
+    """
+
+    if value is None:
+        return ''
+    if value is True or value is False:
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    elif isinstance(value, (list, tuple)):
+        value = _format_array_literal(value)
+    elif isinstance(value, dict):
+        value = json.dumps(value)
+
+    return '"{}"'.format(str(value).replace('"', '""'))
+
+
+def _format_array_literal(values):
+    """
+    Formats a list as a PostgreSQL array literal, eg. `{1,NULL,"a b"}`.
+    """
+
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append('NULL')
+        elif isinstance(value, (list, tuple)):
+            elements.append(_format_array_literal(value))
+        else:
+            if value is True or value is False:
+                value = 'true' if value else 'false'
+            elif isinstance(value, (datetime.date, datetime.time)):
+                value = value.isoformat()
+            elif isinstance(value, dict):
+                value = json.dumps(value)
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+            elements.append('"{}"'.format(value))
+
+    return '{{{}}}'.format(','.join(elements))
+
+
+def load_from_workbook(f, sheets, processes=None, header=True, bulk=True,
+        batch_size=1000, use_copy=False):
+    """
+    Imports the sheets of an XLSX workbook, one model per sheet. The sheets
+    are parsed in a pool of processes, as parsing is what takes most of the
+    time, and loaded from this process into the database with
+    `BaseModel.load_from_rows`, a sheet being loaded only after the sheets it
+    depends on.
+
+    Each sheet is described by a dictionary with the keys:
+        - `model`: The model the rows are loaded into
+        - `column_index`: Model field_name, column index mapper
+        - `depends_on` (optional): Names of the sheets to be loaded before
+        - `empty_check_col`, `repr_col`, `upsert_key` (optional): Same as in
+          `load_from_csv`
+
+    Example:
+        load_from_workbook('seed.xlsx', {
+            'permissions': {
+                'model': Permission,
+                'column_index': {'name': 0, 'bit': (1, int, 'power_of_2')},
+            },
+            'roles': {
+                'model': Role,
+                'column_index': {'name': 0, 'permission_bit_sequence': (1, str, 'permission_tokens')},
+                'depends_on': ['permissions'],
+            },
+        }, processes=4)
+
+    :param str f: Path of the workbook, or a file object (eg. an upload)
+    :param dict sheets: Sheet name, sheet description mapper, in the order
+        the sheets are to be loaded if they don't depend on each other
+    :param int processes: Number of processes to parse the sheets with, the
+        sheets are parsed in this process if not given
+    :param bool header: Flag to determine whether to skip first row of sheets
+    :param bool bulk: Insert the rows in batches, bypassing the session
+    :param int batch_size: Rows per batch in the bulk mode
+    :param bool use_copy: Use COPY instead of executemany on PostgreSQL
+
+    :return dict: The result of each sheet's import, with its `rows_count`,
+        `parse_seconds` and `load_seconds`, under `sheets`, the `order` the
+        sheets were loaded in and the `total_seconds`
+    """
+
+    started_at = time.perf_counter()
+    order = _get_sheets_order(sheets)
+
+    # The workers open the workbook themselves, file objects are read once
+    # and sent as bytes
+    if hasattr(f, 'stream'):
+        f = f.stream
+    if hasattr(f, 'read'):
+        f = f.read()
+
+    tasks = {
+        name: (
+            f,
+            name,
+            header,
+            sheets[name].get('empty_check_col'),
+        ) for name in order
+    }
+
+    executor = None
+    if processes and processes > 1 and len(order) > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=min(processes, len(order))
+        )
+
+    results = {}
+    try:
+        if executor is not None:
+            futures = {
+                name: executor.submit(_parse_workbook_sheet, task)
+                for name, task in tasks.items()
+            }
+
+        for name in order:
+            sheet = sheets[name]
+            if executor is not None:
+                rows, parse_seconds = futures[name].result()
+            else:
+                rows, parse_seconds = _parse_workbook_sheet(tasks[name])
+
+            loading_started_at = time.perf_counter()
+            res = sheet['model'].load_from_rows(
+                rows,
+                sheet['column_index'],
+                repr_col=sheet.get('repr_col', 0),
+                bulk=bulk,
+                batch_size=batch_size,
+                use_copy=use_copy,
+                upsert_key=sheet.get('upsert_key'),
+            )
+            if not bulk and not sheet.get('upsert_key'):
+                db.session.commit()
+
+            res['rows_count'] = len(rows)
+            res['parse_seconds'] = parse_seconds
+            res['load_seconds'] = time.perf_counter() - loading_started_at
+            results[name] = res
+
+            logger.info('Loaded sheet `{}`: {} rows in {:.2f}s + {:.2f}s'.format(
+                name,
+                res['rows_count'],
+                res['parse_seconds'],
+                res['load_seconds'],
+            ))
+    finally:
+        if executor is not None:
+            for future in futures.values():
+                future.cancel()
+            executor.shutdown()
+
+    return {
+        'sheets': results,
+        'order': order,
+        'total_seconds': time.perf_counter() - started_at,
+    }
+
+
+def _get_sheets_order(sheets):
+    """
+    Orders the sheets so that every sheet comes after the ones it depends on,
+    keeping the given order otherwise.
+
+    :return list:
+    """
+
+    for name, sheet in sheets.items():
+        for dependency in sheet.get('depends_on', []):
+            if dependency not in sheets:
+                raise ValueError('`{}`: Unknown sheet `{}` in dependencies'.format(
+                    name,
+                    dependency,
+                ))
+
+    order = []
+    pending = list(sheets)
+    while pending:
+        for name in pending:
+            if all(d in order for d in sheets[name].get('depends_on', [])):
+                order.append(name)
+                pending.remove(name)
+                break
+        else:
+            raise ValueError('Circular dependencies between the sheets: {}'.format(
+                ', '.join(pending)
+            ))
+
+    return order
+
+
+def _parse_workbook_sheet(args):
+    """
+    Reads the rows of a sheet, in a worker process of `load_from_workbook`.
+
+    :return tuple: The rows, the seconds taken
+    """
+
+    f, sheet_name, header, empty_check_col = args
+    started_at = time.perf_counter()
+
+    if isinstance(f, bytes):
+        f = io.BytesIO(f)
+    rows = list(iter_rows_from_workbook(
+        f,
+        sheet_name=sheet_name,
+        header=header,
+        empty_check_col=empty_check_col,
+    ))
+
+    return rows, time.perf_counter() - started_at